@@ -1,33 +1,60 @@
+from collections import Counter, defaultdict
+
 from django.contrib import admin
-from django.db.models import Count
-from recipes.models import (FavoriteRecipe, Ingredients, RecipeIngredient,
-                            Recipes, ShoppingCartRecipe, Subscriptions, Tags)
+from django.db.models import F, Prefetch
+from django.db.models.functions import Greatest
+from jobs.models import Job
+from jobs.registry import enqueue
+from recipes.models import (FavoriteRecipe, FeedItem, Ingredients,
+                            RecipeIngredient, Recipes, ShoppingCartRecipe,
+                            ShoppingListTotal, Subscriptions, Tags,
+                            recipe_amounts)
 from users.models import User
 
+from .cookable import recipes_changed
+from .pagination import ApproximateCountPaginator
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Списки больших таблиц без COUNT(*) всей таблицы: общее число строк
+    не показывается, а число найденных берётся приблизительно.
+    """
+    show_full_result_count = False
+    paginator = ApproximateCountPaginator
+
 
 class RecipeIngredientAdmin(admin.StackedInline):
     model = RecipeIngredient
     min_num = 1
+    autocomplete_fields = ('ingredient',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'recipe',
+            'ingredient',
+        )
 
 
 @admin.register(User)
-class UserAdmin(admin.ModelAdmin):
+class UserAdmin(LargeTableAdmin):
     list_display = (
         'id',
         'username',
         'email',
     )
+    search_fields = ('username', 'email')
 
 
 @admin.register(Ingredients)
-class IngredientsAdmin(admin.ModelAdmin):
+class IngredientsAdmin(LargeTableAdmin):
     list_display = (
         'id',
         'name',
         'measurement_unit',
     )
     search_fields = ('name',)
-    list_filter = ('name',)
+    ordering = ('name',)
 
 
 @admin.register(Tags)
@@ -42,16 +69,16 @@ class TagAdmin(admin.ModelAdmin):
 
 
 @admin.register(Recipes)
-class RecipesAdmin(admin.ModelAdmin):
+class RecipesAdmin(LargeTableAdmin):
     list_display = (
         'id',
         'name',
         'author',
-        'ingredients',
+        'ingredients_list',
         'text',
         'cooking_time',
         'pub_date',
-        'favorite_count',
+        'favorites_count',
     )
     search_fields = (
         'name',
@@ -60,45 +87,204 @@ class RecipesAdmin(admin.ModelAdmin):
         'author__email',
         'ingredients__name'
     )
-    list_filter = ('tags', 'author', 'name')
+    list_filter = ('tags',)
+    list_select_related = ('author',)
+    autocomplete_fields = ('author',)
     inlines = (RecipeIngredientAdmin,)
 
     def get_queryset(self, request):
-        queryset = super().get_queryset(request)
-        queryset = queryset.annotate(favorite_count=Count('favorite_recipes'))
-        return queryset
+        return super().get_queryset(request).defer(
+            'search_vector',
+        ).prefetch_related(
+            Prefetch('ingredients', queryset=Ingredients.objects.only('name')),
+        )
+
+    def save_model(self, request, obj, form, change):
+        old_author_id = None
+        if change:
+            Recipes.objects.lock([obj.pk])
+        if change and 'author' in form.changed_data:
+            old_author_id = Recipes.objects.values_list(
+                'author_id',
+                flat=True,
+            ).get(pk=obj.pk)
+        super().save_model(request, obj, form, change)
+        if old_author_id is not None:
+            User.objects.filter(pk=old_author_id).update(
+                recipes_count=Greatest(F('recipes_count') - 1, 0)
+            )
+            User.objects.filter(pk=obj.author_id).update(
+                recipes_count=F('recipes_count') + 1
+            )
+            FeedItem.objects.filter(recipe=obj).delete()
+            enqueue('feed_fanout', recipe_id=obj.pk)
 
-    def favorite_count(self, obj):
-        return obj.favorite_count
+    def save_related(self, request, form, formsets, change):
+        recipe = form.instance
+        old_amounts = recipe_amounts(recipe) if change else {}
+        super().save_related(request, form, formsets, change)
+        if change:
+            ShoppingListTotal.objects.change_recipe(
+                recipe,
+                old_amounts,
+                recipe_amounts(recipe),
+            )
+        Recipes.objects.filter(pk=recipe.pk).update_search_vector()
+        recipes_changed([recipe.pk])
 
-    favorite_count.short_description = 'Добавления в избранное'
+    def delete_model(self, request, obj):
+        Recipes.objects.lock([obj.pk])
+        ShoppingListTotal.objects.change_recipe(obj, recipe_amounts(obj), {})
+        recipes_changed([obj.pk])
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        recipes = list(queryset)
+        Recipes.objects.lock([recipe.pk for recipe in recipes])
+        for recipe in recipes:
+            ShoppingListTotal.objects.change_recipe(
+                recipe,
+                recipe_amounts(recipe),
+                {},
+            )
+        recipes_changed([recipe.pk for recipe in recipes])
+        super().delete_queryset(request, queryset)
+
+    def ingredients_list(self, obj):
+        return ', '.join(
+            ingredient.name for ingredient in obj.ingredients.all()
+        )
+
+    ingredients_list.short_description = 'Ингредиенты'
 
 
 @admin.register(FavoriteRecipe)
-class FavoriteRecipeAdmin(admin.ModelAdmin):
+class FavoriteRecipeAdmin(LargeTableAdmin):
     list_display = (
         'id',
         'user',
         'recipe',
     )
     search_fields = ('user__email', 'recipe__name')
+    list_select_related = ('user', 'recipe')
+    autocomplete_fields = ('user', 'recipe')
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            old_recipe_id = FavoriteRecipe.objects.values_list(
+                'recipe_id',
+                flat=True,
+            ).get(pk=obj.pk)
+            Recipes.objects.filter(
+                pk=old_recipe_id,
+            ).change_favorites_count(-1)
+        super().save_model(request, obj, form, change)
+        Recipes.objects.filter(pk=obj.recipe_id).change_favorites_count(1)
+
+    def delete_model(self, request, obj):
+        Recipes.objects.filter(pk=obj.recipe_id).change_favorites_count(-1)
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        removed = Counter(queryset.values_list('recipe_id', flat=True))
+        recipe_ids = defaultdict(list)
+        for recipe_id, count in removed.items():
+            recipe_ids[count].append(recipe_id)
+        for count, ids in recipe_ids.items():
+            Recipes.objects.filter(pk__in=ids).change_favorites_count(-count)
+        super().delete_queryset(request, queryset)
 
 
 @admin.register(ShoppingCartRecipe)
-class ShoppingCartRecipeAdmin(admin.ModelAdmin):
+class ShoppingCartRecipeAdmin(LargeTableAdmin):
     list_display = (
         'id',
         'user',
         'recipe',
     )
     search_fields = ('user__email', 'recipe__name')
+    list_select_related = ('user', 'recipe')
+    autocomplete_fields = ('user', 'recipe')
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            old = ShoppingCartRecipe.objects.select_related('user').get(
+                pk=obj.pk,
+            )
+            ShoppingListTotal.objects.remove_recipes(
+                old.user,
+                [old.recipe_id],
+            )
+        super().save_model(request, obj, form, change)
+        ShoppingListTotal.objects.add_recipes(obj.user, [obj.recipe_id])
+
+    def delete_model(self, request, obj):
+        ShoppingListTotal.objects.remove_recipes(obj.user, [obj.recipe_id])
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = defaultdict(list)
+        users = {}
+        for cart_recipe in queryset.select_related('user'):
+            users[cart_recipe.user_id] = cart_recipe.user
+            recipe_ids[cart_recipe.user_id].append(cart_recipe.recipe_id)
+        for user_id, user_recipe_ids in recipe_ids.items():
+            ShoppingListTotal.objects.remove_recipes(
+                users[user_id],
+                user_recipe_ids,
+            )
+        super().delete_queryset(request, queryset)
 
 
 @admin.register(Subscriptions)
-class SubscriptionsAdmin(admin.ModelAdmin):
+class SubscriptionsAdmin(LargeTableAdmin):
     list_display = (
         'id',
         'user',
         'author',
     )
     search_fields = ('user__last_name', 'user__first_name')
+    list_select_related = ('user', 'author')
+    autocomplete_fields = ('user', 'author')
+
+    def save_model(self, request, obj, form, change):
+        if change and not {'user', 'author'} & set(form.changed_data):
+            super().save_model(request, obj, form, change)
+            return
+        if change:
+            old = Subscriptions.objects.select_related('user').get(
+                pk=obj.pk,
+            )
+            FeedItem.objects.unfollow(old.user, [old.author_id])
+        super().save_model(request, obj, form, change)
+        FeedItem.objects.follow(obj.user, [obj.author_id])
+
+    def delete_model(self, request, obj):
+        FeedItem.objects.unfollow(obj.user, [obj.author_id])
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        author_ids = defaultdict(list)
+        users = {}
+        for subscription in queryset.select_related('user'):
+            users[subscription.user_id] = subscription.user
+            author_ids[subscription.user_id].append(subscription.author_id)
+        for user_id, user_author_ids in author_ids.items():
+            FeedItem.objects.unfollow(users[user_id], user_author_ids)
+        super().delete_queryset(request, queryset)
+
+
+@admin.register(Job)
+class JobAdmin(LargeTableAdmin):
+    list_display = (
+        'id',
+        'type',
+        'status',
+        'attempts',
+        'user',
+        'created',
+        'finished_at',
+    )
+    list_filter = ('status', 'type')
+    list_select_related = ('user',)
+    autocomplete_fields = ('user',)
@@ -0,0 +1,65 @@
+from rest_framework import status
+
+
+def result(pk, code, message=None):
+    item = {'id': pk, 'status': code}
+    if message is not None:
+        item['message'] = message
+    return item
+
+
+def add_links(model, user, field, ids, targets, messages, rejected=None):
+    """
+    Связывает пользователя с объектами ids одним
+    INSERT ... ON CONFLICT DO NOTHING RETURNING.
+    messages - тексты ошибок 'exists' и 'not_found', rejected -
+    заранее отклонённые id с текстом ошибки. Возвращает результат
+    для каждого id и список id, связи с которыми добавил именно этот
+    запрос: по нему меняются счётчики и итоги.
+    """
+    rejected = rejected or {}
+    candidates = [pk for pk in ids if pk not in rejected]
+    found = set(
+        targets
+        .filter(pk__in=candidates)
+        .order_by()
+        .values_list('pk', flat=True)
+    )
+    added = set(model.objects.insert_returning(
+        user,
+        field,
+        [pk for pk in candidates if pk in found],
+    ))
+
+    results = []
+    for pk in ids:
+        if pk in rejected:
+            results.append(
+                result(pk, status.HTTP_400_BAD_REQUEST, rejected[pk])
+            )
+        elif pk not in found:
+            results.append(
+                result(pk, status.HTTP_404_NOT_FOUND, messages['not_found'])
+            )
+        elif pk not in added:
+            results.append(
+                result(pk, status.HTTP_400_BAD_REQUEST, messages['exists'])
+            )
+        else:
+            results.append(result(pk, status.HTTP_201_CREATED))
+    return results, [pk for pk in ids if pk in added]
+
+
+def remove_links(model, user, field, ids, message):
+    """
+    Удаляет связи пользователя с объектами ids одним
+    DELETE ... RETURNING. Возвращает результат для каждого id и список
+    id, связи с которыми удалил именно этот запрос.
+    """
+    removed = set(model.objects.delete_returning(user, field, ids))
+    results = [
+        result(pk, status.HTTP_204_NO_CONTENT) if pk in removed
+        else result(pk, status.HTTP_404_NOT_FOUND, message)
+        for pk in ids
+    ]
+    return results, [pk for pk in ids if pk in removed]
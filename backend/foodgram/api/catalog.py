@@ -0,0 +1,151 @@
+import gzip
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from django.core.signals import request_finished, request_started
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from recipes.models import CatalogVersion
+from rest_framework.renderers import JSONRenderer
+
+BODY_CACHE_SIZE = 64
+
+body_cache = OrderedDict()
+body_cache_lock = threading.Lock()
+request_version = threading.local()
+
+
+@receiver(request_started)
+@receiver(request_finished)
+def reset_request_version(**kwargs):
+    """Внутри запроса версия читается из базы один раз."""
+    request_version.active = kwargs['signal'] is request_started
+    request_version.value = None
+
+
+def get_version():
+    """Версия справочников тегов и ингредиентов."""
+    version = getattr(request_version, 'value', None)
+    if version is not None:
+        return version
+    version = CatalogVersion.objects.values_list(
+        'version', flat=True
+    ).first()
+    if version is None:
+        version = CatalogVersion.objects.get_or_create(
+            pk=1,
+            defaults={'version': uuid.uuid4().hex},
+        )[0].version
+    if getattr(request_version, 'active', False):
+        request_version.value = version
+    return version
+
+
+def bump_version():
+    """Меняет версию после любой записи в теги или ингредиенты."""
+    version = uuid.uuid4().hex
+    CatalogVersion.objects.update_or_create(
+        pk=1,
+        defaults={'version': version},
+    )
+    if getattr(request_version, 'active', False):
+        request_version.value = version
+
+
+def get_etag(request, version, encoding=None):
+    """
+    Сильный ETag версии каталога. Сжатое и несжатое тела отличаются
+    побайтно, поэтому у сжатого тела к ETag добавляется кодировка.
+    """
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    suffix = f'-{encoding}' if encoding else ''
+    return f'"{version}-{path[:12]}{suffix}"'
+
+
+def accepts_gzip(request):
+    """Принимает ли клиент gzip по Accept-Encoding с учётом q-значений."""
+    qualities = {}
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, *params = (item.strip() for item in part.split(';'))
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    return qualities.get('gzip', qualities.get('*', 0)) > 0
+
+
+def get_body(key, render):
+    """
+    Возвращает готовое и сжатое тело ответа, храня последние
+    BODY_CACHE_SIZE вариантов в памяти процесса.
+    """
+    with body_cache_lock:
+        if key in body_cache:
+            body_cache.move_to_end(key)
+            return body_cache[key]
+    content = render()
+    body = (content, gzip.compress(content))
+    with body_cache_lock:
+        body_cache[key] = body
+        while len(body_cache) > BODY_CACHE_SIZE:
+            body_cache.popitem(last=False)
+    return body
+
+
+def catalog_cache(list_method):
+    """
+    Отдаёт справочник с ETag по версии каталога. На совпадающий
+    If-None-Match отвечает 304 после одного запроса версии, а полный
+    ответ берёт из кеша уже сериализованных тел.
+    """
+    @wraps(list_method)
+    def wrapper(self, request, *args, **kwargs):
+        version = get_version()
+        is_json = request.accepted_renderer.format == 'json'
+        use_gzip = is_json and accepts_gzip(request)
+        etag = get_etag(request, version, 'gzip' if use_gzip else None)
+        if_none_match = parse_etags(
+            request.META.get('HTTP_IF_NONE_MATCH', '')
+        )
+        if etag in if_none_match or '*' in if_none_match:
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            if is_json:
+                patch_vary_headers(response, ('Accept-Encoding',))
+            return response
+        if not is_json:
+            response = list_method(self, request, *args, **kwargs)
+            response['ETag'] = etag
+            return response
+
+        def render():
+            response = list_method(self, request, *args, **kwargs)
+            return JSONRenderer().render(response.data)
+
+        content, compressed = get_body(
+            (request.get_full_path(), version),
+            render,
+        )
+        response = HttpResponse(
+            compressed if use_gzip else content,
+            content_type='application/json',
+        )
+        if use_gzip:
+            response['Content-Encoding'] = 'gzip'
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+    return wrapper
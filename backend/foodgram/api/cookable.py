@@ -0,0 +1,225 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Max
+from recipes.models import RecipeIndexChange, RecipeIngredient
+
+from .catalog import get_version
+
+MAX_CHANGES = 1000
+MAX_AGE = 60 * 60
+
+
+def recipes_changed(recipe_ids):
+    """
+    Записывает изменение ингредиентов рецептов в журнал, по которому
+    индексы всех процессов обновляются без полной перестройки.
+    Запись делается после коммита, чтобы индекс не прочитал старые строки.
+    Журнал хранит последние MAX_CHANGES записей.
+    """
+    recipe_ids = list(recipe_ids)
+
+    def publish():
+        change = RecipeIndexChange.objects.create(recipe_ids=recipe_ids)
+        if change.pk % MAX_CHANGES == 0:
+            RecipeIndexChange.objects.filter(
+                pk__lte=change.pk - MAX_CHANGES,
+            ).delete()
+
+    if recipe_ids:
+        transaction.on_commit(publish)
+
+
+def last_sequence():
+    """Номер последнего изменения в журнале."""
+    return RecipeIndexChange.objects.aggregate(
+        sequence=Max('pk'),
+    )['sequence'] or 0
+
+
+class RecipeIngredientIndex:
+    """
+    Обратный индекс ингредиент -> отсортированный массив id рецептов
+    в памяти процесса. Для набора ингредиентов покрытие каждого рецепта
+    считается сложением списков рецептов этих ингредиентов, без
+    GROUP BY по всей таблице ингредиентов рецептов.
+
+    Опубликованные массивы рецептов не меняются: изменения пишутся в
+    копии, поэтому подбор считает покрытие без блокировки. Ингредиенты
+    рецепта хранятся плоским массивом с границами по id рецепта, а
+    изменённые после построения рецепты лежат в словаре changed.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.built_at = None
+        self.sequence = 0
+        self.postings = {}
+        self.sizes = array('H')
+        self.offsets = array('l', [0])
+        self.ingredients = array('i')
+        self.changed = {}
+
+    def is_stale(self):
+        return (
+            self.built_at is None
+            or time.monotonic() - self.built_at > MAX_AGE
+            or self.version != get_version()
+        )
+
+    def build(self):
+        version = get_version()
+        sequence = last_sequence()
+        postings = defaultdict(lambda: array('i'))
+        sizes = array('H')
+        for ingredient_id, recipe_id in (
+            RecipeIngredient.objects
+            .values_list('ingredient_id', 'recipe_id')
+            .order_by('ingredient_id', 'recipe_id')
+            .distinct()
+            .iterator()
+        ):
+            postings[ingredient_id].append(recipe_id)
+            if recipe_id >= len(sizes):
+                sizes.extend([0] * (recipe_id + 1 - len(sizes)))
+            sizes[recipe_id] += 1
+
+        offsets = array('l', [0])
+        for size in sizes:
+            offsets.append(offsets[-1] + size)
+        ingredients = array('i', [0]) * offsets[-1]
+        positions = offsets[:-1]
+        for ingredient_id, recipes in postings.items():
+            for recipe_id in recipes:
+                ingredients[positions[recipe_id]] = ingredient_id
+                positions[recipe_id] += 1
+
+        self.postings = dict(postings)
+        self.sizes = sizes
+        self.offsets = offsets
+        self.ingredients = ingredients
+        self.changed = {}
+        self.sequence = sequence
+        self.version = version
+        self.built_at = time.monotonic()
+
+    def refresh(self):
+        if self.is_stale():
+            with self.lock:
+                if self.is_stale():
+                    self.build()
+            return
+        if last_sequence() != self.sequence:
+            with self.lock:
+                self.apply_changes(last_sequence())
+
+    def apply_changes(self, sequence):
+        """
+        Перечитывает ингредиенты рецептов из журнала изменений. Индекс
+        строится заново, если журнал начат заново (номер стал меньше),
+        если нужные записи уже удалены или ещё не видны и если
+        изменений больше MAX_CHANGES.
+        """
+        if sequence == self.sequence:
+            return
+        if not 0 < sequence - self.sequence <= MAX_CHANGES:
+            self.build()
+            return
+        changes = list(
+            RecipeIndexChange.objects
+            .filter(pk__gt=self.sequence, pk__lte=sequence)
+            .values_list('recipe_ids', flat=True)
+        )
+        if len(changes) < sequence - self.sequence:
+            self.build()
+            return
+        recipe_ids = {recipe_id for ids in changes for recipe_id in ids}
+        ingredients = defaultdict(set)
+        for ingredient_id, recipe_id in (
+            RecipeIngredient.objects
+            .filter(recipe_id__in=recipe_ids)
+            .values_list('ingredient_id', 'recipe_id')
+        ):
+            ingredients[recipe_id].add(ingredient_id)
+        postings = {}
+        for recipe_id in recipe_ids:
+            self.remove_recipe(recipe_id, postings)
+            self.add_recipe(recipe_id, ingredients[recipe_id], postings)
+        self.postings = {**self.postings, **postings}
+        self.sequence = sequence
+
+    def ingredients_of(self, recipe_id):
+        if recipe_id in self.changed:
+            return self.changed[recipe_id]
+        if recipe_id + 1 >= len(self.offsets):
+            return ()
+        return self.ingredients[
+            self.offsets[recipe_id]:self.offsets[recipe_id + 1]
+        ]
+
+    def writable(self, ingredient_id, postings):
+        """Копия массива рецептов ингредиента, которую можно менять."""
+        if ingredient_id not in postings:
+            postings[ingredient_id] = array(
+                'i',
+                self.postings.get(ingredient_id, ()),
+            )
+        return postings[ingredient_id]
+
+    def remove_recipe(self, recipe_id, postings):
+        for ingredient_id in self.ingredients_of(recipe_id):
+            recipes = self.writable(ingredient_id, postings)
+            position = bisect_left(recipes, recipe_id)
+            if position < len(recipes) and recipes[position] == recipe_id:
+                del recipes[position]
+        self.changed[recipe_id] = ()
+        if recipe_id < len(self.sizes):
+            self.sizes[recipe_id] = 0
+
+    def add_recipe(self, recipe_id, ingredient_ids, postings):
+        if not ingredient_ids:
+            return
+        if recipe_id >= len(self.sizes):
+            self.sizes.extend([0] * (recipe_id + 1 - len(self.sizes)))
+        for ingredient_id in ingredient_ids:
+            insort(self.writable(ingredient_id, postings), recipe_id)
+        self.changed[recipe_id] = tuple(sorted(ingredient_ids))
+        self.sizes[recipe_id] = len(ingredient_ids)
+
+    def match(self, ingredients, missing=0):
+        """
+        Рецепты, в которых есть хотя бы один из ингредиентов ingredients
+        и не хватает не больше missing остальных. Возвращает кортежи
+        (id рецепта, найдено ингредиентов, не хватает): сначала рецепты,
+        которым не хватает меньше, затем с большим покрытием, затем новые.
+        Под блокировкой берутся только ссылки на массивы рецептов.
+        """
+        self.refresh()
+        with self.lock:
+            recipe_lists = [
+                self.postings.get(ingredient_id, ())
+                for ingredient_id in set(ingredients)
+            ]
+            sizes = self.sizes
+        # Размеры рецептов меняются на месте, поэтому рецепт, изменённый
+        # после взятия ссылок, может дать отрицательную нехватку.
+        covered = Counter()
+        for recipes in recipe_lists:
+            covered.update(recipes)
+        matches = [
+            (sizes[recipe_id] - count, -count, -recipe_id)
+            for recipe_id, count in covered.items()
+            if 0 <= sizes[recipe_id] - count <= missing
+        ]
+        matches.sort()
+        return [
+            (-recipe_id, -count, lacking)
+            for lacking, count, recipe_id in matches
+        ]
+
+
+recipe_index = RecipeIngredientIndex()
@@ -1,5 +1,23 @@
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
 from django_filters import rest_framework as filters
-from recipes.models import Ingredients, Recipes, Tags
+from recipes.models import (FavoriteRecipe, Ingredients, Recipes,
+                            ShoppingCartRecipe, Tags)
+
+from .catalog import get_version
+
+
+def tag_ids_by_slug():
+    """Id тегов по slug, кешируются до изменения справочников."""
+    return cache.get_or_set(
+        f'tag_ids:{get_version()}',
+        lambda: dict(Tags.objects.values_list('slug', 'id')),
+        None,
+    )
+
+
+def tag_choices():
+    return [(slug, slug) for slug in tag_ids_by_slug()]
 
 
 class IngredientFilter(filters.FilterSet):
@@ -11,20 +29,63 @@ class IngredientFilter(filters.FilterSet):
 
 
 class RecipeFilter(filters.FilterSet):
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tags.objects.all(),
+    """
+    Фильтры по тегам, избранному и корзине проверяются подзапросами
+    EXISTS, поэтому строки рецептов не размножаются и DISTINCT не нужен.
+    """
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_choices,
+        method='filter_tags',
     )
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
-    author = filters.NumberFilter(field_name='author__id')
+    is_in_shopping_cart = filters.BooleanFilter(
+        method='filter_is_in_shopping_cart',
+    )
+    author = filters.NumberFilter(field_name='author_id')
+    search = filters.CharFilter(method='filter_search')
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'По популярности'),),
+        method='filter_ordering',
+    )
 
-    def filter_is_favorited(self, queryset, name, value):
+    def filter_tags(self, queryset, name, value):
+        tag_ids = tag_ids_by_slug()
+        return queryset.filter(Exists(Recipes.tags.through.objects.filter(
+            recipes_id=OuterRef('pk'),
+            tags_id__in=[tag_ids[slug] for slug in value if slug in tag_ids],
+        )))
+
+    def filter_user_link(self, queryset, model, value):
         user = self.request.user
         if value and not user.is_anonymous:
-            return queryset.filter(favorite_recipes__user=user)
+            return queryset.filter(Exists(model.objects.filter(
+                user=user,
+                recipe=OuterRef('pk'),
+            )))
         return queryset
 
+    def filter_is_favorited(self, queryset, name, value):
+        return self.filter_user_link(queryset, FavoriteRecipe, value)
+
+    def filter_is_in_shopping_cart(self, queryset, name, value):
+        return self.filter_user_link(queryset, ShoppingCartRecipe, value)
+
+    def filter_search(self, queryset, name, value):
+        value = value.strip()
+        if not value:
+            return queryset
+        return queryset.search(value)
+
+    def filter_ordering(self, queryset, name, value):
+        return queryset.popular()
+
     class Meta:
         model = Recipes
-        fields = ['author', 'tags', 'is_favorited']
+        fields = [
+            'author',
+            'tags',
+            'is_favorited',
+            'is_in_shopping_cart',
+            'search',
+            'ordering',
+        ]
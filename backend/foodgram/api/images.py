@@ -0,0 +1,115 @@
+import io
+import logging
+import os
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import F
+from PIL import Image, ImageOps, UnidentifiedImageError
+from recipes.models import Recipes
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = 'recipes/images/variants/'
+VARIANT_SIZES = {
+    'small': (300, 300),
+    'medium': (600, 600),
+}
+VARIANT_FORMATS = {
+    'webp': 'WEBP',
+    'jpeg': 'JPEG',
+}
+QUALITY = 80
+
+
+def make_variants(name):
+    """
+    Уменьшенные копии картинки рецепта в WebP и JPEG. Возвращает
+    словарь путей вида {'source': name, 'small': {'webp': path, ...}}.
+    """
+    with default_storage.open(name) as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image.load()
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    stem = os.path.splitext(os.path.basename(name))[0]
+    variants = {'source': name}
+    for size_name, size in VARIANT_SIZES.items():
+        thumbnail = image.copy()
+        thumbnail.thumbnail(size, Image.LANCZOS)
+        for extension, image_format in VARIANT_FORMATS.items():
+            buffer = io.BytesIO()
+            thumbnail.save(buffer, image_format, quality=QUALITY)
+            variants.setdefault(size_name, {})[extension] = (
+                default_storage.save(
+                    f'{VARIANTS_DIR}{stem}_{size_name}.{extension}',
+                    ContentFile(buffer.getvalue()),
+                )
+            )
+    return variants
+
+
+def variant_paths(variants):
+    return [
+        path
+        for size_name in VARIANT_SIZES
+        for path in variants.get(size_name, {}).values()
+    ]
+
+
+def delete_variants(variants):
+    for path in variant_paths(variants):
+        default_storage.delete(path)
+
+
+def drop_stale_variants(recipe_id, variants):
+    """
+    Удаляет копии прежней картинки рецепта. Ссылка на них в рецепте
+    очищается, только если новые копии ещё не записаны.
+    """
+    Recipes.objects.filter(
+        pk=recipe_id,
+        image_variants__source=variants.get('source'),
+    ).update(image_variants={})
+    delete_variants(variants)
+
+
+def update_variants(recipe_id, name):
+    """
+    Создаёт варианты картинки и сохраняет их в рецепте, если картинка
+    за это время не сменилась. Старые варианты удаляются.
+    """
+    try:
+        variants = make_variants(name)
+    except (OSError, UnidentifiedImageError):
+        logger.exception('Cannot make variants of %s', name)
+        return False
+    recipes = Recipes.objects.filter(pk=recipe_id, image=name)
+    old_variants = recipes.values_list('image_variants', flat=True).first()
+    updated = recipes.update(
+        image_variants=variants,
+        version=F('version') + 1,
+    )
+    if not updated:
+        delete_variants(variants)
+        return False
+    if old_variants:
+        delete_variants(old_variants)
+    return True
+
+
+def variants_ready(recipe):
+    """Копии созданы для текущей картинки рецепта."""
+    return bool(recipe.image) and (
+        recipe.image_variants.get('source') == recipe.image.name
+    )
+
+
+def needs_variants(recipe):
+    return bool(recipe.image) and not variants_ready(recipe)
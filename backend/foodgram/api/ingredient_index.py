@@ -0,0 +1,138 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+from recipes.models import Ingredients
+
+from .catalog import get_version
+
+MAX_AGE = 300
+TRIGRAM_THRESHOLD = 0.3
+FUZZY_LIMIT = 10
+
+
+def normalize(value):
+    return value.strip().casefold().replace('ё', 'е')
+
+
+def trigrams(value):
+    value = f'  {value} '
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+class IndexSnapshot(namedtuple('IndexSnapshot', (
+    'version',
+    'built_at',
+    'keys',
+    'items',
+    'trigram_postings',
+    'trigram_counts',
+))):
+    """
+    Неизменяемое содержимое индекса. Новый снимок собирается целиком
+    и публикуется одним присваиванием, поэтому поиск без блокировки
+    никогда не видит ключи одной сборки и ингредиенты другой.
+    """
+    __slots__ = ()
+
+    def startswith(self, prefix):
+        start = bisect_left(self.keys, prefix)
+        end = start
+        while end < len(self.keys) and self.keys[end].startswith(prefix):
+            end += 1
+        return list(self.items[start:end])
+
+    def similar(self, query):
+        query_trigrams = trigrams(query)
+        shared = defaultdict(int)
+        for trigram in query_trigrams:
+            for position in self.trigram_postings.get(trigram, ()):
+                shared[position] += 1
+        scored = []
+        for position, common in shared.items():
+            similarity = common / (
+                len(query_trigrams) + self.trigram_counts[position] - common
+            )
+            if similarity >= TRIGRAM_THRESHOLD:
+                scored.append((-similarity, self.keys[position], position))
+        scored.sort()
+        return [
+            self.items[position] for _, _, position in scored[:FUZZY_LIMIT]
+        ]
+
+
+EMPTY_SNAPSHOT = IndexSnapshot(None, None, (), (), {}, ())
+
+
+class IngredientIndex:
+    """
+    Отсортированный по названию список ингредиентов в памяти процесса.
+    Поиск по началу названия делается бинарным поиском, а при опечатке
+    ингредиенты подбираются по совпадающим триграммам.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshot = EMPTY_SNAPSHOT
+
+    def is_stale(self):
+        snapshot = self.snapshot
+        return (
+            snapshot.built_at is None
+            or time.monotonic() - snapshot.built_at > MAX_AGE
+            or snapshot.version != get_version()
+        )
+
+    def build(self):
+        version = get_version()
+        rows = sorted(
+            (normalize(name), pk, name, measurement_unit)
+            for pk, name, measurement_unit
+            in Ingredients.objects.values_list(
+                'id',
+                'name',
+                'measurement_unit',
+            )
+        )
+        trigram_postings = defaultdict(list)
+        trigram_counts = []
+        for position, row in enumerate(rows):
+            row_trigrams = trigrams(row[0])
+            trigram_counts.append(len(row_trigrams))
+            for trigram in row_trigrams:
+                trigram_postings[trigram].append(position)
+        self.snapshot = IndexSnapshot(
+            version=version,
+            built_at=time.monotonic(),
+            keys=tuple(row[0] for row in rows),
+            items=tuple(
+                {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+                for _, pk, name, measurement_unit in rows
+            ),
+            trigram_postings={
+                trigram: tuple(positions)
+                for trigram, positions in trigram_postings.items()
+            },
+            trigram_counts=tuple(trigram_counts),
+        )
+
+    def refresh(self):
+        if self.is_stale():
+            with self.lock:
+                if self.is_stale():
+                    self.build()
+
+    def search(self, query):
+        self.refresh()
+        snapshot = self.snapshot
+        query = normalize(query)
+        found = snapshot.startswith(query)
+        if found or not query:
+            return found
+        if getattr(settings, 'INGREDIENT_SEARCH_TYPOS', True):
+            return snapshot.similar(query)
+        return []
+
+
+ingredient_index = IngredientIndex()
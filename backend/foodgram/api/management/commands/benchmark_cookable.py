@@ -0,0 +1,97 @@
+import random
+import statistics
+import time
+
+from api.cookable import recipe_index
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F, Q
+from recipes.models import RecipeIngredient
+
+
+def sql_match(ingredient_ids, missing=0):
+    """Тот же подбор рецептов одним GROUP BY по ингредиентам рецептов."""
+    return [
+        (row['recipe_id'], row['covered'], row['total'] - row['covered'])
+        for row in RecipeIngredient.objects
+        .values('recipe_id')
+        .annotate(
+            total=Count('ingredient_id', distinct=True),
+            covered=Count(
+                'ingredient_id',
+                distinct=True,
+                filter=Q(ingredient_id__in=ingredient_ids),
+            ),
+        )
+        .filter(covered__gt=0, total__lte=F('covered') + missing)
+        .order_by(F('total') - F('covered'), '-covered', '-recipe_id')
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Compare the in-memory ingredient index with the SQL GROUP BY'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--queries',
+            type=int,
+            default=20,
+            help='Number of random ingredient sets'
+        )
+        parser.add_argument(
+            '--ingredients',
+            type=int,
+            default=8,
+            help='Ingredients in each set'
+        )
+        parser.add_argument(
+            '--missing',
+            type=int,
+            default=1,
+            help='Allowed number of missing ingredients'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Random seed'
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        recipe_index.build()
+        build_time = time.perf_counter() - started
+        ingredient_ids = sorted(recipe_index.postings)
+        if len(ingredient_ids) < options['ingredients']:
+            raise CommandError('Not enough ingredients used in recipes')
+
+        rng = random.Random(options['seed'])
+        index_times = []
+        sql_times = []
+        for _ in range(options['queries']):
+            pantry = rng.sample(ingredient_ids, options['ingredients'])
+
+            started = time.perf_counter()
+            from_index = recipe_index.match(pantry, options['missing'])
+            index_times.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            from_sql = sql_match(pantry, options['missing'])
+            sql_times.append(time.perf_counter() - started)
+
+            if from_index != from_sql:
+                raise CommandError(f'Results differ for ingredients {pantry}')
+
+        self.stdout.write(
+            f'Index built in {build_time * 1000:.1f} ms: '
+            f'{len(ingredient_ids)} ingredients, '
+            f'{sum(map(len, recipe_index.postings.values()))} postings'
+        )
+        for name, times in (('index', index_times), ('sql', sql_times)):
+            self.stdout.write(
+                f'{name:>5}: median {statistics.median(times) * 1000:.3f} ms,'
+                f' max {max(times) * 1000:.3f} ms'
+            )
+        speedup = statistics.median(sql_times) / statistics.median(index_times)
+        self.stdout.write(self.style.SUCCESS(
+            f'Index is {speedup:.0f}x faster, results match'
+        ))
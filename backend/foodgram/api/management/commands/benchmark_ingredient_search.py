@@ -0,0 +1,95 @@
+import random
+import time
+
+from api.ingredient_index import ingredient_index
+from django.core.management.base import BaseCommand, CommandError
+from recipes.models import Ingredients
+
+
+def orm_search(prefix):
+    """Прежний поиск ингредиентов фильтром name__istartswith."""
+    return list(
+        Ingredients.objects
+        .filter(name__istartswith=prefix)
+        .values('id', 'name', 'measurement_unit')
+    )
+
+
+def lookups_per_second(search, prefixes, duration):
+    """Число поисков в секунду по кругу из prefixes за duration секунд."""
+    lookups = 0
+    started = time.perf_counter()
+    deadline = started + duration
+    while time.perf_counter() < deadline:
+        search(prefixes[lookups % len(prefixes)])
+        lookups += 1
+    return lookups / (time.perf_counter() - started)
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare ingredient autocomplete lookups per second '
+        'of the in-memory index and the ORM istartswith filter'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--prefixes',
+            type=int,
+            default=200,
+            help='Number of random name prefixes'
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=2,
+            help='Seconds to run each search'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Random seed'
+        )
+
+    def handle(self, *args, **options):
+        names = list(Ingredients.objects.values_list('name', flat=True))
+        if not names:
+            raise CommandError('No ingredients, run import_csv first')
+        rng = random.Random(options['seed'])
+        prefixes = []
+        for _ in range(options['prefixes']):
+            name = rng.choice(names)
+            prefixes.append(name[:rng.randint(1, min(len(name), 4))])
+
+        started = time.perf_counter()
+        ingredient_index.build()
+        build_time = time.perf_counter() - started
+
+        # Индекс сравнивает названия без учёта регистра и буквы «ё»,
+        # а istartswith в SQLite учитывает регистр кириллицы, поэтому
+        # выдача может расходиться: такие префиксы только считаются.
+        differ = 0
+        for prefix in prefixes:
+            expected = {item['id'] for item in orm_search(prefix)}
+            found = {item['id'] for item in ingredient_index.search(prefix)}
+            differ += bool(expected) and expected != found
+        self.stdout.write(
+            f'{len(names)} ingredients, index built in '
+            f'{build_time * 1000:.1f} ms, '
+            f'{differ} of {len(prefixes)} prefixes found differently'
+        )
+        rates = {}
+        for name, search in (
+            ('index', ingredient_index.search),
+            ('orm', orm_search),
+        ):
+            rates[name] = lookups_per_second(
+                search,
+                prefixes,
+                options['duration'],
+            )
+            self.stdout.write(f'{name:>5}: {rates[name]:.0f} lookups/s')
+        self.stdout.write(self.style.SUCCESS(
+            f'Index is {rates["index"] / rates["orm"]:.0f}x faster'
+        ))
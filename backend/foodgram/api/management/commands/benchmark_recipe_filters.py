@@ -0,0 +1,84 @@
+import statistics
+import time
+
+from api.filters import RecipeFilter
+from django.core.management.base import BaseCommand, CommandError
+from django.http import QueryDict
+from recipes.models import Recipes, Tags
+
+PAGE_SIZE = 6
+
+
+def measure(queryset, repeat):
+    """Время COUNT(*) и первой страницы, как у списка рецептов."""
+    count_times = []
+    page_times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        count = queryset.count()
+        count_times.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        page = list(
+            queryset
+            .order_by('-pub_date', '-id')
+            .values_list('id', flat=True)[:PAGE_SIZE]
+        )
+        page_times.append(time.perf_counter() - started)
+    return count, page, count_times, page_times
+
+
+class Command(BaseCommand):
+    help = 'Compare tag filtering through a join with DISTINCT and EXISTS'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tags',
+            type=int,
+            default=5,
+            help='Number of selected tags'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Runs of each query'
+        )
+
+    def handle(self, *args, **options):
+        slugs = list(
+            Tags.objects.order_by('id').values_list('slug', flat=True)
+            [:options['tags']]
+        )
+        if len(slugs) < options['tags']:
+            raise CommandError('Not enough tags')
+        params = QueryDict(mutable=True)
+        params.setlist('tags', slugs)
+        querysets = (
+            (
+                'join',
+                Recipes.objects.filter(tags__slug__in=slugs).distinct(),
+            ),
+            (
+                'exists',
+                RecipeFilter(params, queryset=Recipes.objects.all()).qs,
+            ),
+        )
+        self.stdout.write(
+            f'{Recipes.objects.count()} recipes, tags: {", ".join(slugs)}'
+        )
+        results = []
+        for name, queryset in querysets:
+            count, page, count_times, page_times = measure(
+                queryset,
+                options['repeat'],
+            )
+            results.append((count, page))
+            self.stdout.write(
+                f'{name:>6}: count {count} in '
+                f'{statistics.median(count_times) * 1000:.1f} ms, '
+                f'first page in {statistics.median(page_times) * 1000:.1f} ms'
+            )
+        if results[0] != results[1]:
+            raise CommandError('Results differ')
+        self.stdout.write(self.style.SUCCESS('Results match'))
@@ -0,0 +1,108 @@
+import statistics
+import time
+
+from api.serializers import RecipesReadSerializer
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from recipes.models import Recipes, prefetch_for_read
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from users.models import User
+
+ORDERING = ('-pub_date', '-id')
+
+
+def plain_page(user, size):
+    """Страница рецептов без подгрузки связанных объектов."""
+    return list(Recipes.objects.order_by(*ORDERING)[:size])
+
+
+def read_page(user, size):
+    """Страница рецептов так, как её загружает список рецептов."""
+    recipes = list(Recipes.objects.for_read(user).order_by(*ORDERING)[:size])
+    prefetch_for_read(recipes, user)
+    return recipes
+
+
+PAGE_LOADERS = (('plain', plain_page), ('read', read_page))
+
+
+class QueryCounter:
+    """Считает запросы к базе без журнала запросов DEBUG."""
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def measure(load_page, request, size, repeat):
+    """Число запросов и время загрузки и сериализации страницы."""
+    times = []
+    for _ in range(repeat):
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            started = time.perf_counter()
+            data = RecipesReadSerializer(
+                load_page(request.user, size),
+                many=True,
+                context={'request': request},
+            ).data
+            times.append(time.perf_counter() - started)
+    return data, counter.count, times
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare queries and latency of recipe pages loaded '
+        'with and without the read query plan'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=[6, 50, 100],
+            help='Page sizes'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Runs of each page'
+        )
+        parser.add_argument(
+            '--user',
+            type=int,
+            help='Id of the viewing user, anonymous by default'
+        )
+
+    def handle(self, *args, **options):
+        user = AnonymousUser()
+        if options['user'] is not None:
+            user = User.objects.filter(pk=options['user']).first()
+            if user is None:
+                raise CommandError('User not found')
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        request.user = user
+        self.stdout.write(f'{Recipes.objects.count()} recipes')
+        for size in options['sizes']:
+            results = []
+            for name, load_page in PAGE_LOADERS:
+                data, queries, times = measure(
+                    load_page,
+                    request,
+                    size,
+                    options['repeat'],
+                )
+                results.append(data)
+                self.stdout.write(
+                    f'{size:>4} recipes {name:>5}: {queries} queries, '
+                    f'median {statistics.median(times) * 1000:.1f} ms'
+                )
+            if results[0] != results[1]:
+                raise CommandError(f'Results differ for page of {size}')
+        self.stdout.write(self.style.SUCCESS('Results match'))
@@ -0,0 +1,318 @@
+from api.catalog import bump_version
+from api.representation_cache import representation_cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from recipes.models import (FavoriteRecipe, FeedItem, Ingredients,
+                            RecipeIngredient, Recipes, ShoppingCartRecipe,
+                            ShoppingListTotal, Subscriptions, Tags,
+                            reconcile_counters)
+from rest_framework.test import APIClient
+from users.models import User
+
+PAGE_SIZES = (6, 50, 100)
+RECIPES_COUNT = 120
+TAGS_COUNT = 8
+INGREDIENTS_COUNT = 60
+INGREDIENTS_PER_RECIPE = 8
+
+ANON = 'anon'
+AUTH = 'auth'
+
+# (метод, адрес, ожидаемый статус для каждой роли, допустимое число
+# запросов, тело запроса из payloads). Каждый запрос измеряется с
+# пустыми кешами, а лимит равен числу запросов на холодном кеше плюс
+# HEADROOM: лишний запрос не ломает проверку, а N+1 в списках
+# (страницы по 6, 50 и 100 объектов) её превышает.
+HEADROOM = 2
+ROUTES = (
+    ('get', '/api/tags/', {ANON: 200, AUTH: 200}, 2),
+    ('get', '/api/tags/{tag}/', {ANON: 200, AUTH: 200}, 1),
+    ('get', '/api/ingredients/', {ANON: 200, AUTH: 200}, 2),
+    ('get', '/api/ingredients/?name=ing', {ANON: 200, AUTH: 200}, 2),
+    ('get', '/api/ingredients/{ingredient}/', {ANON: 200, AUTH: 200}, 1),
+    ('get', '/api/users/?limit={limit}', {ANON: 401, AUTH: 200}, 2),
+    ('get', '/api/users/{author}/', {ANON: 200, AUTH: 200}, 1),
+    ('get', '/api/users/me/', {ANON: 401, AUTH: 200}, 1),
+    (
+        'get',
+        '/api/users/subscriptions/?limit={limit}&recipes_limit=3',
+        {ANON: 401, AUTH: 200},
+        3,
+    ),
+    ('get', '/api/recipes/?limit={limit}', {ANON: 200, AUTH: 200}, 7),
+    (
+        'get',
+        '/api/recipes/?limit={limit}&cursor=',
+        {ANON: 200, AUTH: 200},
+        6,
+    ),
+    (
+        'get',
+        '/api/recipes/?limit={limit}&tags={tag_slug}',
+        {ANON: 200, AUTH: 200},
+        7,
+    ),
+    (
+        'get',
+        '/api/recipes/?limit={limit}&author={author}',
+        {ANON: 200, AUTH: 200},
+        7,
+    ),
+    (
+        'get',
+        '/api/recipes/?limit={limit}&is_favorited=1',
+        {ANON: 200, AUTH: 200},
+        7,
+    ),
+    (
+        'get',
+        '/api/recipes/?limit={limit}&is_in_shopping_cart=1',
+        {ANON: 200, AUTH: 200},
+        7,
+    ),
+    (
+        'get',
+        '/api/recipes/?limit={limit}&search=budget',
+        {ANON: 200, AUTH: 200},
+        7,
+    ),
+    (
+        'get',
+        '/api/recipes/?limit={limit}&ordering=popular',
+        {ANON: 200, AUTH: 200},
+        7,
+    ),
+    (
+        'get',
+        '/api/recipes/?limit={limit}&ordering=popular&cursor=',
+        {ANON: 200, AUTH: 200},
+        6,
+    ),
+    ('get', '/api/recipes/{recipe}/', {ANON: 200, AUTH: 200}, 6),
+    (
+        'get',
+        '/api/recipes/cookable/'
+        '?limit={limit}&ingredients={ingredient}&missing=9',
+        {ANON: 200, AUTH: 200},
+        7,
+    ),
+    ('get', '/api/recipes/feed/?limit={limit}', {ANON: 401, AUTH: 200}, 7),
+    (
+        'get',
+        '/api/recipes/feed/?limit={limit}&tags={tag_slug}',
+        {AUTH: 200},
+        7,
+    ),
+    ('post', '/api/recipes/{fresh_recipe}/favorite/', {AUTH: 200}, 5),
+    ('post', '/api/recipes/{fresh_recipe}/favorite/', {AUTH: 400}, 4),
+    ('delete', '/api/recipes/{fresh_recipe}/favorite/', {AUTH: 204}, 4),
+    ('delete', '/api/recipes/{fresh_recipe}/favorite/', {AUTH: 404}, 3),
+    ('post', '/api/recipes/{fresh_recipe}/shopping_cart/', {AUTH: 200}, 9),
+    ('post', '/api/recipes/{fresh_recipe}/shopping_cart/', {AUTH: 400}, 4),
+    (
+        'delete',
+        '/api/recipes/{fresh_recipe}/shopping_cart/',
+        {AUTH: 204},
+        8,
+    ),
+    (
+        'delete',
+        '/api/recipes/{fresh_recipe}/shopping_cart/',
+        {AUTH: 404},
+        3,
+    ),
+    ('post', '/api/users/{fresh_author}/subscribe/', {AUTH: 200}, 7),
+    ('delete', '/api/users/{fresh_author}/subscribe/', {AUTH: 204}, 4),
+    (
+        'get',
+        '/api/recipes/download_shopping_cart/?format={export_format}',
+        {ANON: 401, AUTH: 200},
+        1,
+    ),
+    ('post', '/api/recipes/', {ANON: 401, AUTH: 201}, 16, 'recipe'),
+    ('patch', '/api/recipes/{own_recipe}/', {AUTH: 200}, 22, 'recipe'),
+    ('delete', '/api/recipes/{own_recipe}/', {AUTH: 204}, 15),
+)
+EXPORT_FORMATS = ('pdf', 'csv', 'txt')
+
+
+class Command(BaseCommand):
+    help = 'Check the number of SQL queries made by every API endpoint'
+
+    def handle(self, *args, **options):
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            with transaction.atomic():
+                params = self.seed()
+                failures = self.check_routes(params)
+                transaction.set_rollback(True)
+        if failures:
+            raise CommandError(
+                f'{failures} endpoints exceeded query budget '
+                'or returned an unexpected status'
+            )
+        self.stdout.write(self.style.SUCCESS('All query budgets are met'))
+
+    def seed(self):
+        viewer = User.objects.create_user(
+            username='budgetviewer',
+            email='budget-viewer@example.com',
+            password='budget-password',
+            first_name='Budget',
+            last_name='Viewer',
+            is_staff=True,
+        )
+        authors = [
+            User.objects.create_user(
+                username=f'budgetauthor{number}',
+                email=f'budget-author{number}@example.com',
+                password='budget-password',
+                first_name='Budget',
+                last_name=f'Author{number}',
+            )
+            for number in range(4)
+        ]
+        tags = Tags.objects.bulk_create(
+            Tags(
+                name=f'budget tag {number}',
+                color='#FFFFFF',
+                slug=f'budget-tag-{number}',
+            )
+            for number in range(TAGS_COUNT)
+        )
+        ingredients = Ingredients.objects.bulk_create(
+            Ingredients(name=f'ingredient {number}', measurement_unit='г')
+            for number in range(INGREDIENTS_COUNT)
+        )
+        recipes = Recipes.objects.bulk_create(
+            Recipes(
+                author=authors[number % len(authors)],
+                name=f'budget recipe {number}',
+                text='budget recipe text',
+                cooking_time=10,
+                image='recipes/images/temp.png',
+            )
+            for number in range(RECIPES_COUNT)
+        )
+        own_recipe = Recipes.objects.create(
+            author=viewer,
+            name='budget own recipe',
+            text='budget recipe text',
+            cooking_time=10,
+            image='recipes/images/temp.png',
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe,
+                ingredient=ingredients[(number + shift) % INGREDIENTS_COUNT],
+                amount=shift + 1,
+            )
+            for number, recipe in enumerate(recipes)
+            for shift in range(INGREDIENTS_PER_RECIPE)
+        )
+        Recipes.tags.through.objects.bulk_create(
+            Recipes.tags.through(
+                recipes_id=recipe.id,
+                tags_id=tags[(number + shift) % TAGS_COUNT].id,
+            )
+            for number, recipe in enumerate(recipes)
+            for shift in range(3)
+        )
+        FavoriteRecipe.objects.bulk_create(
+            FavoriteRecipe(user=viewer, recipe=recipe)
+            for recipe in recipes[1::3]
+        )
+        ShoppingCartRecipe.objects.bulk_create(
+            ShoppingCartRecipe(user=viewer, recipe=recipe)
+            for recipe in recipes[1:21]
+        )
+        ShoppingListTotal.objects.rebuild()
+        Subscriptions.objects.bulk_create(
+            Subscriptions(user=viewer, author=author)
+            for author in authors[1:]
+        )
+        FeedItem.objects.rebuild()
+        reconcile_counters()
+        return {
+            'viewer': viewer,
+            'tag': tags[0].id,
+            'tag_slug': tags[0].slug,
+            'ingredient': ingredients[0].id,
+            'author': authors[1].id,
+            'fresh_author': authors[0].id,
+            'recipe': recipes[1].id,
+            'fresh_recipe': recipes[0].id,
+            'own_recipe': own_recipe.id,
+            'payloads': {
+                'recipe': {
+                    'name': 'budget new recipe',
+                    'text': 'budget recipe text',
+                    'cooking_time': 15,
+                    'tags': [tag.id for tag in tags[:3]],
+                    'ingredients': [
+                        {'id': ingredient.id, 'amount': number + 1}
+                        for number, ingredient in enumerate(
+                            ingredients[:INGREDIENTS_PER_RECIPE]
+                        )
+                    ],
+                },
+            },
+        }
+
+    def check_routes(self, params):
+        failures = 0
+        clients = {ANON: APIClient(), AUTH: APIClient()}
+        clients[AUTH].force_authenticate(params['viewer'])
+        for method, url, statuses, budget, *payload in ROUTES:
+            data = params['payloads'][payload[0]] if payload else None
+            urls = sorted({
+                url.format(
+                    limit=limit,
+                    export_format=export_format,
+                    **params,
+                )
+                for limit in PAGE_SIZES
+                for export_format in EXPORT_FORMATS
+            })
+            for role, expected_status in statuses.items():
+                for current_url in urls:
+                    failures += not self.check_route(
+                        clients[role],
+                        method,
+                        current_url,
+                        data,
+                        role,
+                        expected_status,
+                        budget,
+                    )
+        return failures
+
+    def check_route(self, client, method, url, data, role, expected_status,
+                    budget):
+        # Каждый запрос измеряется с пустыми кешами: новая версия
+        # справочников делает недоступными id тегов, тела справочников,
+        # индекс ингредиентов и общий кеш представлений рецептов.
+        bump_version()
+        representation_cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(client, method)(url, data, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+        queries = len(context)
+        limit = budget + HEADROOM
+        line = (
+            f'{method.upper()} {url} [{role}] '
+            f'{response.status_code}: {queries}/{limit} queries'
+        )
+        if response.status_code != expected_status:
+            self.stdout.write(self.style.ERROR(
+                f'ERROR {line}, expected status {expected_status}'
+            ))
+            return False
+        if queries <= limit:
+            self.stdout.write(f'OK    {line}')
+            return True
+        self.stdout.write(self.style.ERROR(f'FAIL  {line}'))
+        for number, query in enumerate(context.captured_queries, 1):
+            self.stdout.write(f'  {number}. {query["sql"]}')
+        return False
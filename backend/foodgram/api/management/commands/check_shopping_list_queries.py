@@ -0,0 +1,120 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from recipes.models import (Ingredients, RecipeIngredient, Recipes,
+                            ShoppingCartRecipe, ShoppingListTotal)
+from rest_framework.test import APIClient
+from users.models import User
+
+CART_SIZES = (1, 10, 50)
+INGREDIENTS_COUNT = 150
+INGREDIENTS_PER_RECIPE = 8
+EXPORT_FORMATS = ('pdf', 'csv', 'txt')
+URL = '/api/recipes/download_shopping_cart/?format={export_format}'
+
+
+class Command(BaseCommand):
+    help = (
+        'Check that downloading the shopping list makes the same number '
+        'of SQL queries for carts of any size'
+    )
+
+    def handle(self, *args, **options):
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            with transaction.atomic():
+                failures = self.check_formats(self.seed())
+                transaction.set_rollback(True)
+        if failures:
+            raise CommandError(
+                f'{failures} formats depend on the size of the cart'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            'Shopping list queries do not depend on the size of the cart'
+        ))
+
+    def seed(self):
+        author = User.objects.create_user(
+            username='cartauthor',
+            email='cart-author@example.com',
+            password='cart-password',
+            first_name='Cart',
+            last_name='Author',
+        )
+        ingredients = Ingredients.objects.bulk_create(
+            Ingredients(name=f'cart ingredient {number}', measurement_unit='г')
+            for number in range(INGREDIENTS_COUNT)
+        )
+        recipes = Recipes.objects.bulk_create(
+            Recipes(
+                author=author,
+                name=f'cart recipe {number}',
+                text='cart recipe text',
+                cooking_time=10,
+                image='recipes/images/temp.png',
+            )
+            for number in range(max(CART_SIZES))
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe,
+                ingredient=ingredients[
+                    (number * INGREDIENTS_PER_RECIPE + shift)
+                    % INGREDIENTS_COUNT
+                ],
+                amount=shift + 1,
+            )
+            for number, recipe in enumerate(recipes)
+            for shift in range(INGREDIENTS_PER_RECIPE)
+        )
+        users = []
+        for size in CART_SIZES:
+            user = User.objects.create_user(
+                username=f'cartuser{size}',
+                email=f'cart-user{size}@example.com',
+                password='cart-password',
+                first_name='Cart',
+                last_name=f'User{size}',
+            )
+            ShoppingCartRecipe.objects.bulk_create(
+                ShoppingCartRecipe(user=user, recipe=recipe)
+                for recipe in recipes[:size]
+            )
+            users.append(user)
+        ShoppingListTotal.objects.rebuild()
+        return users
+
+    def check_formats(self, users):
+        failures = 0
+        for export_format in EXPORT_FORMATS:
+            url = URL.format(export_format=export_format)
+            results = [self.download(user, url) for user in users]
+            counts = [len(context) for _, context in results]
+            line = ', '.join(
+                f'{size} recipes: {count}'
+                for size, count in zip(CART_SIZES, counts)
+            )
+            statuses = {response.status_code for response, _ in results}
+            if statuses != {200}:
+                failures += 1
+                self.stdout.write(self.style.ERROR(
+                    f'ERROR {url}: statuses {sorted(statuses)}'
+                ))
+                continue
+            if len(set(counts)) == 1:
+                self.stdout.write(f'OK    {url}: {line} queries')
+                continue
+            failures += 1
+            self.stdout.write(self.style.ERROR(f'FAIL  {url}: {line} queries'))
+            _, context = results[-1]
+            for number, query in enumerate(context.captured_queries, 1):
+                self.stdout.write(f'  {number}. {query["sql"]}')
+        return failures
+
+    def download(self, user, url):
+        client = APIClient()
+        client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return response, context
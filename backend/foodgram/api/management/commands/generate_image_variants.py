@@ -0,0 +1,47 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from api.images import needs_variants, update_variants
+from django.core.management.base import BaseCommand
+from recipes.models import Recipes
+
+
+class Command(BaseCommand):
+    help = 'Generate resized WebP/JPEG variants of recipe images'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Regenerate variants that already exist'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of worker threads'
+        )
+
+    def handle(self, *args, **options):
+        recipes = (
+            Recipes.objects
+            .exclude(image='')
+            .exclude(image__isnull=True)
+            .only('id', 'image', 'image_variants')
+            .order_by('id')
+        )
+        tasks = [
+            (recipe.id, recipe.image.name)
+            for recipe in recipes.iterator()
+            if options['force'] or needs_variants(recipe)
+        ]
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            results = list(executor.map(
+                lambda task: update_variants(*task),
+                tasks,
+            ))
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Image variants generated: {sum(results)} of {len(tasks)}'
+            )
+        )
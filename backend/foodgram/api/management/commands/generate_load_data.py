@@ -0,0 +1,279 @@
+import io
+import random
+from array import array
+from itertools import islice
+
+from api.catalog import bump_version
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from recipes.models import (FavoriteRecipe, FeedItem, Ingredients,
+                            RecipeIngredient, Recipes, ShoppingCartRecipe,
+                            ShoppingListTotal, Subscriptions, Tags,
+                            reconcile_counters)
+from users.models import User
+
+TAG_COLORS = ('#E26C2D', '#49B64E', '#8775D2', '#F9A62B', '#2D9CDB')
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with synthetic data for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument(
+            '--authors-share',
+            type=float,
+            default=0.2,
+            help='Share of users who publish recipes'
+        )
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--tags', type=int, default=10)
+        parser.add_argument(
+            '--ingredients-per-recipe',
+            type=int,
+            default=8,
+            help='Average number of ingredients in a recipe'
+        )
+        parser.add_argument(
+            '--favorites-per-user',
+            type=int,
+            default=20,
+            help='Average number of favorite recipes per user'
+        )
+        parser.add_argument(
+            '--cart-per-user',
+            type=int,
+            default=5,
+            help='Average number of recipes in a shopping cart'
+        )
+        parser.add_argument(
+            '--subscriptions-per-user',
+            type=int,
+            default=10,
+            help='Average number of followed authors per user'
+        )
+        parser.add_argument(
+            '--skew',
+            type=float,
+            default=3.0,
+            help='Popularity skew, 1 means uniform'
+        )
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument(
+            '--copy',
+            action='store_true',
+            help='Load link tables with PostgreSQL COPY'
+        )
+        parser.add_argument(
+            '--prefix',
+            default='load',
+            help='Prefix for generated usernames and tag slugs'
+        )
+
+    def handle(self, *args, **options):
+        if options['copy'] and connection.vendor != 'postgresql':
+            raise CommandError('--copy is supported only on PostgreSQL')
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+
+        ingredient_ids = array(
+            'l',
+            Ingredients.objects.order_by('id').values_list('id', flat=True),
+        )
+        if not ingredient_ids:
+            raise CommandError(
+                'No ingredients found, run import_csv first'
+            )
+        tag_ids = self.create_tags()
+        user_ids = self.create_users()
+        authors_count = max(1, int(len(user_ids) * options['authors_share']))
+        author_ids = user_ids[:authors_count]
+        recipe_ids = self.create_recipes(author_ids)
+
+        self.write_links(
+            RecipeIngredient,
+            ('recipe_id', 'ingredient_id', 'amount'),
+            (
+                (recipe_id, ingredient_id, self.rng.randint(1, 500))
+                for recipe_id in recipe_ids
+                for ingredient_id in self.pick(
+                    ingredient_ids,
+                    options['ingredients_per_recipe'],
+                )
+            ),
+        )
+        self.update_search_vectors(recipe_ids)
+        self.write_links(
+            Recipes.tags.through,
+            ('recipes_id', 'tags_id'),
+            (
+                (recipe_id, tag_id)
+                for recipe_id in recipe_ids
+                for tag_id in self.pick(tag_ids, 2)
+            ),
+        )
+        self.write_links(
+            FavoriteRecipe,
+            ('user_id', 'recipe_id'),
+            self.user_links(
+                user_ids,
+                recipe_ids,
+                options['favorites_per_user'],
+            ),
+        )
+        self.write_links(
+            ShoppingCartRecipe,
+            ('user_id', 'recipe_id'),
+            self.user_links(user_ids, recipe_ids, options['cart_per_user']),
+        )
+        self.write_links(
+            Subscriptions,
+            ('user_id', 'author_id'),
+            (
+                (user_id, author_id)
+                for user_id, author_id in self.user_links(
+                    user_ids,
+                    author_ids,
+                    options['subscriptions_per_user'],
+                )
+                if user_id != author_id
+            ),
+        )
+        ShoppingListTotal.objects.rebuild()
+        FeedItem.objects.rebuild()
+        reconcile_counters()
+        self.stdout.write(
+            self.style.SUCCESS('Load data generated successfully')
+        )
+
+    def skewed_index(self, size):
+        """
+        Индекс от 0 до size - 1 с длинным хвостом: первые элементы
+        выпадают намного чаще остальных.
+        """
+        return int(size * self.rng.random() ** self.options['skew'])
+
+    def pick(self, population, average):
+        """Уникальные популярные элементы, в среднем average штук."""
+        count = min(
+            len(population),
+            max(1, round(self.rng.expovariate(1 / average))),
+        )
+        picked = set()
+        for _ in range(count * 2):
+            picked.add(population[self.skewed_index(len(population))])
+            if len(picked) == count:
+                break
+        return picked
+
+    def user_links(self, user_ids, target_ids, average):
+        for user_id in user_ids:
+            for target_id in self.pick(target_ids, average):
+                yield user_id, target_id
+
+    def create_tags(self):
+        prefix = self.options['prefix']
+        Tags.objects.bulk_create(
+            (
+                Tags(
+                    name=f'{prefix} tag {number}',
+                    color=TAG_COLORS[number % len(TAG_COLORS)],
+                    slug=f'{prefix}-tag-{number}',
+                )
+                for number in range(self.options['tags'])
+            ),
+            ignore_conflicts=True,
+        )
+        bump_version()
+        return array('l', Tags.objects.filter(
+            slug__startswith=f'{prefix}-tag-',
+        ).values_list('id', flat=True))
+
+    def create_users(self):
+        prefix = self.options['prefix']
+        offset = User.objects.filter(username__startswith=prefix).count()
+        password = make_password(f'{prefix}-password')
+        user_ids = array('l')
+        users = (
+            User(
+                username=f'{prefix}{number}',
+                email=f'{prefix}{number}@example.com',
+                password=password,
+                first_name=prefix.capitalize(),
+                last_name=f'User{number}',
+            )
+            for number in range(offset, offset + self.options['users'])
+        )
+        for batch in batched(users, self.batch_size):
+            user_ids.extend(
+                user.id for user in User.objects.bulk_create(batch)
+            )
+        self.stdout.write(f'Users: {len(user_ids)}')
+        return user_ids
+
+    def create_recipes(self, author_ids):
+        recipe_ids = array('l')
+        recipes = (
+            Recipes(
+                author_id=author_ids[self.skewed_index(len(author_ids))],
+                name=f'Рецепт {number}',
+                text=f'Описание рецепта {number}',
+                cooking_time=self.rng.randint(5, 180),
+            )
+            for number in range(self.options['recipes'])
+        )
+        for batch in batched(recipes, self.batch_size):
+            recipe_ids.extend(
+                recipe.id for recipe in Recipes.objects.bulk_create(batch)
+            )
+        self.stdout.write(f'Recipes: {len(recipe_ids)}')
+        return recipe_ids
+
+    def update_search_vectors(self, recipe_ids):
+        """Поисковый вектор включает ингредиенты и считается после них."""
+        total = 0
+        for batch in batched(recipe_ids, self.batch_size):
+            total += Recipes.objects.filter(
+                pk__in=batch,
+            ).update_search_vector()
+        self.stdout.write(f'Search vectors: {total}')
+
+    def write_links(self, model, fields, rows):
+        """Записывает строки из целых чисел пачками."""
+        total = 0
+        for batch in batched(rows, self.batch_size):
+            if self.options['copy']:
+                self.copy_batch(model, fields, batch)
+            else:
+                model.objects.bulk_create(
+                    model(**dict(zip(fields, row))) for row in batch
+                )
+            total += len(batch)
+        self.stdout.write(f'{model._meta.verbose_name_plural}: {total}')
+
+    def copy_batch(self, model, fields, batch):
+        buffer = io.StringIO(
+            ''.join('\t'.join(map(str, row)) + '\n' for row in batch)
+        )
+        columns = ', '.join(
+            connection.ops.quote_name(model._meta.get_field(field).column)
+            for field in fields
+        )
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f'COPY {connection.ops.quote_name(model._meta.db_table)} '
+                f'({columns}) FROM STDIN',
+                buffer,
+            )
@@ -1,40 +1,112 @@
 import csv
+import json
+import os
+from itertools import islice
 
-from django.core.management.base import BaseCommand
-from django.db import connection
+from api.catalog import bump_version
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 from recipes.models import Ingredients
 
+HEADERS = {('name', 'unit'), ('name', 'measurement_unit')}
+
+
+def read_csv(file):
+    reader = csv.reader(file)
+    for number, row in enumerate(reader):
+        if number == 0 and tuple(row[:2]) in HEADERS:
+            continue
+        if len(row) >= 2:
+            yield row[0], row[1]
+
+
+def read_json(file):
+    for item in json.load(file):
+        yield item['name'], item['measurement_unit']
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+}
+
 
 class Command(BaseCommand):
-    help = 'Import ingredients from CSV file'
+    help = 'Import ingredients from CSV or JSON file'
 
     def add_arguments(self, parser):
         parser.add_argument(
             'csv_file',
             type=str,
-            help='Path to the CSV file'
+            help='Path to the CSV or JSON file'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show new ingredients without saving them'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of ingredients per INSERT'
         )
 
     def handle(self, *args, **options):
-        csv_file = options['csv_file']
-        Ingredients.objects.all().delete()
-        with connection.cursor() as cursor:
-            cursor.execute(
-                "ALTER SEQUENCE recipes_ingredients_id_seq RESTART WITH 1"
+        path = options['csv_file']
+        reader = READERS.get(os.path.splitext(path)[1].lower())
+        if reader is None:
+            raise CommandError('Only .csv and .json files are supported')
+
+        existing = set(
+            Ingredients.objects.values_list('name', 'measurement_unit')
+        )
+        with open(path, 'r', encoding='utf-8') as file:
+            new_ingredients = self.new_ingredients(reader(file), existing)
+            if options['dry_run']:
+                return self.show_diff(new_ingredients, len(existing))
+            created = 0
+            with transaction.atomic():
+                while True:
+                    batch = list(
+                        islice(new_ingredients, options['batch_size'])
+                    )
+                    if not batch:
+                        break
+                    Ingredients.objects.bulk_create(
+                        (
+                            Ingredients(name=name, measurement_unit=unit)
+                            for name, unit in batch
+                        ),
+                        ignore_conflicts=True,
+                    )
+                    created += len(batch)
+            if created:
+                bump_version()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Ingredients imported successfully: {created} new, '
+                f'{len(existing)} already existed'
             )
-        with open(csv_file, 'r') as file:
-            reader = csv.reader(file)
-            next(reader)
-
-            for row in reader:
-                name = row[0]
-                unit = row[1]
-                ingredient = Ingredients(
-                    name=name,
-                    measurement_unit=unit
-                )
-                ingredient.save()
+        )
+
+    def new_ingredients(self, rows, existing):
+        """Ингредиенты из файла, которых ещё нет в базе."""
+        seen = set(existing)
+        for name, unit in rows:
+            key = (name.strip(), unit.strip())
+            if not all(key) or key in seen:
+                continue
+            seen.add(key)
+            yield key
 
+    def show_diff(self, new_ingredients, existing_count):
+        count = 0
+        for name, unit in new_ingredients:
+            self.stdout.write(f'+ {name} ({unit})')
+            count += 1
         self.stdout.write(
-            self.style.SUCCESS('Ingredients imported successfully')
+            f'Dry run: {count} new ingredients, '
+            f'{existing_count} already existed'
         )
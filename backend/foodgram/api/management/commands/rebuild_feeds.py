@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from jobs.registry import enqueue
+from recipes.models import FeedItem
+
+
+class Command(BaseCommand):
+    help = 'Rebuild subscription feeds from subscriptions and recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--background',
+            action='store_true',
+            help='Queue the rebuild for the run_jobs worker'
+        )
+
+    def handle(self, *args, **options):
+        if options['background']:
+            job = enqueue('rebuild_feeds', unique=True)
+            self.stdout.write(f'Rebuild queued as job {job.pk}')
+            return
+        with transaction.atomic():
+            FeedItem.objects.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Feeds rebuilt: {FeedItem.objects.count()} items'
+            )
+        )
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from jobs.registry import enqueue
+from recipes.models import ShoppingListTotal
+
+
+class Command(BaseCommand):
+    help = 'Rebuild and verify shopping list totals'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only verify totals without rebuilding them'
+        )
+        parser.add_argument(
+            '--background',
+            action='store_true',
+            help='Queue the rebuild for the run_jobs worker'
+        )
+
+    def handle(self, *args, **options):
+        if options['background']:
+            job = enqueue('rebuild_shopping_lists', unique=True)
+            self.stdout.write(f'Rebuild queued as job {job.pk}')
+            return
+        if not options['check']:
+            with transaction.atomic():
+                ShoppingListTotal.objects.rebuild()
+            self.stdout.write('Shopping list totals rebuilt')
+
+        stale = ShoppingListTotal.objects.stale()
+        missing = ShoppingListTotal.objects.missing()
+        for label, rows in (('stored', stale), ('expected', missing)):
+            for user_id, ingredient_id, amount in rows[:10]:
+                self.stdout.write(
+                    f'user {user_id}, ingredient {ingredient_id}: '
+                    f'{label} {amount}'
+                )
+        mismatches = stale.count() + missing.count()
+        if mismatches:
+            raise CommandError(
+                f'{mismatches} shopping list totals are out of date'
+            )
+        self.stdout.write(
+            self.style.SUCCESS('Shopping list totals are consistent')
+        )
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from recipes.models import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = 'Verify and fix favorite and recipe counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report counters that are out of date'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            mismatches = reconcile_counters(fix=not options['check'])
+        for field, count in mismatches.items():
+            self.stdout.write(f'{field}: {count} out of date')
+        if options['check'] and any(mismatches.values()):
+            raise CommandError('Counters are out of date')
+        self.stdout.write(self.style.SUCCESS(
+            'Counters are consistent' if options['check']
+            else 'Counters reconciled'
+        ))
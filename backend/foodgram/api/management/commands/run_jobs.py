@@ -0,0 +1,155 @@
+import multiprocessing
+import os
+import socket
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from jobs.models import Job
+from jobs.registry import TASKS
+from jobs.worker import run_job, setup
+
+MAINTENANCE_INTERVAL = 60
+RESULT_TTL = 24 * 60 * 60
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs from the database queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=2,
+            help='Number of worker processes'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='Seconds between queue checks when idle'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit when the queue is empty'
+        )
+
+    def handle(self, *args, **options):
+        self.processes = options['processes']
+        self.worker = f'{socket.gethostname()}:{os.getpid()}'
+        self.pool = self.make_pool()
+        self.running = {}
+        maintained_at = 0
+        self.stdout.write(
+            f'Worker {self.worker} started, task types: '
+            f'{", ".join(sorted(TASKS))}'
+        )
+        try:
+            while True:
+                if time.monotonic() - maintained_at > MAINTENANCE_INTERVAL:
+                    self.fail_stale()
+                    Job.objects.purge(RESULT_TTL)
+                    maintained_at = time.monotonic()
+                self.expire_running()
+                self.start_jobs()
+                if not self.running:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+                done, _ = wait(
+                    self.running,
+                    timeout=options['poll_interval'],
+                    return_when=FIRST_COMPLETED,
+                )
+                self.collect(done)
+        finally:
+            self.stop_pool()
+
+    def make_pool(self):
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=setup,
+        )
+
+    def stop_pool(self):
+        """
+        Останавливает пул, не дожидаясь выполняющихся задач: процессы
+        завершаются принудительно, иначе зависшая задача продолжала бы
+        занимать процесс.
+        """
+        processes = list((self.pool._processes or {}).values())
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+
+    def restart_pool(self, error):
+        """Пересоздаёт пул, засчитывая выполнявшимся задачам неудачу."""
+        self.stop_pool()
+        for job in self.running.values():
+            job.fail(error)
+        self.running = {}
+        self.pool = self.make_pool()
+
+    def start_jobs(self):
+        """Запускает задачи, пока есть свободные процессы и лимиты типов."""
+        limits = {name: task.concurrency for name, task in TASKS.items()}
+        while len(self.running) < self.processes:
+            job = Job.objects.claim(limits, self.worker)
+            if job is None:
+                return
+            self.running[self.pool.submit(run_job, job.pk)] = job
+
+    def collect(self, done):
+        broken = False
+        for future in done:
+            job = self.running.pop(future)
+            try:
+                job.finish(future.result())
+                self.stdout.write(f'{job} done')
+            except BrokenProcessPool:
+                broken = True
+                job.fail('Worker process terminated abruptly')
+                self.stderr.write(f'{job} failed: worker process died')
+            except Exception:
+                job.fail(traceback.format_exc())
+                self.stderr.write(f'{job} failed, attempt {job.attempts}')
+        if broken:
+            self.restart_pool('Worker process terminated abruptly')
+
+    def expire_running(self):
+        """
+        Задачи этого обработчика дольше своего timeout считаются
+        неудачной попыткой. Отменить задачу в процессе пула нельзя,
+        поэтому пул пересоздаётся, а остальные его задачи повторятся.
+        """
+        now = timezone.now()
+        expired = [
+            future for future, job in self.running.items()
+            if (now - job.started_at).total_seconds()
+            > TASKS[job.type].timeout
+        ]
+        if not expired:
+            return
+        for future in expired:
+            job = self.running.pop(future)
+            job.fail('Job timed out')
+            self.stderr.write(f'{job} timed out')
+        self.restart_pool('Worker restarted after another job timed out')
+
+    def fail_stale(self):
+        """
+        Задачи других обработчиков дольше своего timeout (например,
+        оставшиеся после их остановки) считаются неудачной попыткой.
+        Свои задачи проверяет expire_running.
+        """
+        running = {job.pk for job in self.running.values()}
+        for name, task in TASKS.items():
+            for job in Job.objects.stale(name, task.timeout):
+                if job.pk not in running:
+                    job.fail('Job timed out')
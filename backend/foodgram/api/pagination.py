@@ -0,0 +1,314 @@
+import base64
+import hashlib
+import json
+from collections import OrderedDict
+from datetime import datetime
+
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.paginator import (EmptyPage, InvalidPage, Page,
+                                   PageNotAnInteger, Paginator)
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+COUNT_THRESHOLD = 10000
+COUNT_CACHE_TIMEOUT = 60
+
+
+class ApproximatePage(Page):
+    """
+    Страница при приблизительном числе строк: есть ли следующая,
+    определяется по лишней строке, а не по оценке числа строк.
+    """
+    def __init__(self, object_list, number, paginator, has_more):
+        super().__init__(object_list, number, paginator)
+        self.has_more = has_more
+
+    def has_next(self):
+        return self.has_more
+
+
+class ApproximateCountPaginator(Paginator):
+    """
+    Paginator, который для больших выборок не считает COUNT(*).
+    В PostgreSQL число строк берётся из оценки планировщика, в остальных
+    базах точное значение кешируется для каждого набора фильтров.
+    Выборки меньше COUNT_THRESHOLD всегда считаются точно.
+    """
+    def __init__(self, *args, exact=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.exact = exact
+
+    @cached_property
+    def counted(self):
+        """Число строк и признак того, что оно приблизительное."""
+        if self.exact or not hasattr(self.object_list, 'query'):
+            return super().count, False
+        queryset = self.object_list.order_by()
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql':
+            estimate = self.planner_estimate(queryset, connection)
+            if estimate < COUNT_THRESHOLD:
+                return super().count, False
+            return estimate, True
+        sql, params = queryset.query.sql_with_params()
+        key = 'count:' + hashlib.md5(
+            f'{sql}{params!r}'.encode()
+        ).hexdigest()
+        cached = cache.get(key)
+        if cached is not None and cached >= COUNT_THRESHOLD:
+            return cached, True
+        count = super().count
+        cache.set(key, count, COUNT_CACHE_TIMEOUT)
+        return count, False
+
+    @property
+    def count(self):
+        return self.counted[0]
+
+    @property
+    def is_approximate(self):
+        return self.counted[1]
+
+    def planner_estimate(self, queryset, connection):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def validate_number(self, number):
+        """При приблизительном числе строк не отсекает дальние страницы."""
+        if not self.is_approximate:
+            return super().validate_number(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('Номер страницы должен быть числом')
+        if number < 1:
+            raise InvalidPage('Номер страницы меньше 1')
+        return number
+
+    def page(self, number):
+        """
+        При приблизительном числе строк страница не обрезается по оценке:
+        выбирается на одну строку больше, и по ней видно, есть ли
+        следующая страница. Пустые страницы после первой не отдаются.
+        """
+        number = self.validate_number(number)
+        if not self.is_approximate:
+            return super().page(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage('Страница не содержит результатов')
+        return ApproximatePage(
+            rows[:self.per_page],
+            number,
+            self,
+            has_more=len(rows) > self.per_page,
+        )
+
+
+class ApproximateCountPagination(PageNumberPagination):
+    """
+    Пагинация с приблизительным числом объектов. Точное значение
+    можно запросить параметром exact_count=1.
+    """
+    exact_count_query_param = 'exact_count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.exact_count = request.query_params.get(
+            self.exact_count_query_param, ''
+        ).lower() in ('1', 'true')
+        return super().paginate_queryset(queryset, request, view)
+
+    def django_paginator_class(self, *args, **kwargs):
+        return ApproximateCountPaginator(
+            *args,
+            exact=self.exact_count,
+            **kwargs,
+        )
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.page.paginator.count),
+            ('count_is_approximate', self.page.paginator.is_approximate),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+
+class UserPagination(ApproximateCountPagination):
+    page_size = 6
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+
+class SubscriptionsPagination(ApproximateCountPagination):
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+
+class RecipesPagination(UserPagination):
+    """
+    Постраничная пагинация рецептов. С параметром cursor (для первой
+    страницы пустым) включается курсорная пагинация без OFFSET и
+    COUNT(*), только ссылки next и previous. Курсор строится по
+    активной сортировке: по умолчанию (pub_date, id), для
+    ordering=popular (favorites_count, pub_date, id), для поиска
+    (search_rank, pub_date, id).
+    """
+    cursor_query_param = 'cursor'
+    cursor_fields = ('pub_date', 'id')
+    cursor_required = False
+    invalid_cursor_message = 'Неверный курсор.'
+    invalid_ordering_message = (
+        'Курсорная пагинация не поддерживает эту сортировку.'
+    )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.use_cursor = (
+            self.cursor_required
+            or self.cursor_query_param in request.query_params
+        )
+        if not self.use_cursor:
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        self.fields = self.get_cursor_fields(queryset)
+        page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(
+            request.query_params.get(self.cursor_query_param, ''),
+            queryset.model,
+        )
+        if reverse:
+            queryset = queryset.order_by(*self.fields)
+        else:
+            queryset = queryset.order_by(
+                *(f'-{field}' for field in self.fields)
+            )
+        if position is not None:
+            queryset = queryset.filter(
+                self.after(position, 'gt' if reverse else 'lt')
+            )
+
+        page = list(queryset[:page_size + 1])
+        has_more = len(page) > page_size
+        self.page = page[:page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        return self.page
+
+    def get_cursor_fields(self, queryset):
+        """
+        Поля курсора по сортировке queryset. Поддерживается только
+        сортировка по убыванию, которая заканчивается последним полем
+        cursor_fields, иначе страницы не продолжают друг друга.
+        """
+        ordering = queryset.query.order_by
+        if not ordering:
+            return self.cursor_fields
+        if (
+            not all(
+                isinstance(field, str) and field.startswith('-')
+                for field in ordering
+            )
+            or ordering[-1] != f'-{self.cursor_fields[-1]}'
+        ):
+            raise ValidationError(
+                {self.cursor_query_param: self.invalid_ordering_message}
+            )
+        return tuple(field[1:] for field in ordering)
+
+    def after(self, position, lookup):
+        """Условие «строка после position» для сортировки по self.fields."""
+        condition = Q()
+        for number, field in enumerate(self.fields):
+            condition |= Q(
+                **dict(zip(self.fields[:number], position[:number])),
+                **{f'{field}__{lookup}': position[number]},
+            )
+        return condition
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_next_link(self):
+        if not self.use_cursor:
+            return super().get_next_link()
+        if not self.has_next or not self.page:
+            return None
+        return self.get_cursor_link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.use_cursor:
+            return super().get_previous_link()
+        if not self.has_previous or not self.page:
+            return None
+        return self.get_cursor_link(self.page[0], reverse=True)
+
+    def get_cursor_link(self, obj, reverse):
+        values = []
+        for field in self.fields:
+            value = getattr(obj, field)
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            values.append(value)
+        cursor = base64.urlsafe_b64encode(
+            json.dumps([int(reverse), *values]).encode()
+        ).decode()
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            cursor,
+        )
+
+    def decode_cursor(self, cursor, model):
+        if not cursor:
+            return None, False
+        try:
+            reverse, *values = json.loads(base64.urlsafe_b64decode(
+                cursor.encode()
+            ))
+            if len(values) != len(self.fields):
+                raise ValueError(cursor)
+            position = []
+            for field, value in zip(self.fields, values):
+                if value is None:
+                    raise ValueError(cursor)
+                try:
+                    position.append(
+                        model._meta.get_field(field).to_python(value)
+                    )
+                except FieldDoesNotExist:
+                    position.append(float(value))
+            return position, reverse == 1
+        except (TypeError, ValueError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class FeedPagination(RecipesPagination):
+    """
+    Лента подписок: всегда курсорная пагинация по записям ленты
+    (pub_date, recipe_id).
+    """
+    cursor_fields = ('pub_date', 'recipe_id')
+    cursor_required = True
@@ -0,0 +1,97 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from recipes.models import prefetch_for_read
+
+from .catalog import get_version
+
+LOCAL_SIZE = 2048
+SHARED_TIMEOUT = 24 * 60 * 60
+
+
+class RecipeRepresentationCache:
+    """
+    Кеш общей для всех пользователей части представления рецепта.
+    Ключ включает версию рецепта и версию справочников, поэтому
+    изменённые рецепты, теги и ингредиенты просто перестают находиться.
+    Хранится в памяти процесса (LRU) и, если задан
+    RECIPE_REPRESENTATION_CACHE, в общем кеше Django.
+    """
+    def __init__(self, size=LOCAL_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_shared(self):
+        alias = getattr(settings, 'RECIPE_REPRESENTATION_CACHE', None)
+        return caches[alias] if alias else None
+
+    def get_local(self, keys):
+        found = {}
+        with self.lock:
+            for key in keys:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    found[key] = self.entries[key]
+        return found
+
+    def set_local(self, items):
+        with self.lock:
+            self.entries.update(items)
+            for key in items:
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def represent(self, recipes, serializer):
+        request = serializer.context['request']
+        prefix = (
+            f'recipe:{request.build_absolute_uri("/")}:{get_version()}'
+        )
+        keys = {
+            recipe.id: f'{prefix}:{recipe.id}:{recipe.version}'
+            for recipe in recipes
+        }
+        found = self.get_local(keys.values())
+        shared = self.get_shared()
+        if shared is not None and len(found) < len(keys):
+            from_shared = shared.get_many(
+                [key for key in keys.values() if key not in found]
+            )
+            found.update(from_shared)
+            self.set_local(from_shared)
+
+        misses = [recipe for recipe in recipes if keys[recipe.id] not in found]
+        if misses:
+            prefetch_for_read(misses, request.user)
+            created = {
+                keys[recipe.id]: serializer.to_shared_representation(recipe)
+                for recipe in misses
+            }
+            found.update(created)
+            self.set_local(created)
+            if shared is not None:
+                shared.set_many(created, SHARED_TIMEOUT)
+
+        representations = []
+        for recipe in recipes:
+            data = found[keys[recipe.id]].copy()
+            data['author'] = data['author'].copy()
+            data['author']['is_subscribed'] = (
+                serializer.get_author_subscribed(recipe)
+            )
+            data['is_favorited'] = serializer.get_is_favorited(recipe)
+            data['is_in_shopping_cart'] = (
+                serializer.get_is_in_shopping_cart(recipe)
+            )
+            representations.append(data)
+        return representations
+
+
+representation_cache = RecipeRepresentationCache()
@@ -3,14 +3,24 @@ import re
 
 from django.core.exceptions import ValidationError
 from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+from django.urls import reverse
 from djoser.serializers import UserCreateSerializer, UserSerializer
+from jobs.models import Job
 from recipes.models import (FavoriteRecipe, Ingredients, RecipeIngredient,
-                            Recipes, ShoppingCartRecipe, Subscriptions, Tags)
+                            Recipes, ShoppingCartRecipe, ShoppingListTotal,
+                            Subscriptions, Tags, prefetch_for_read)
 from rest_framework import serializers
 from users.models import User
 
+from .cookable import recipes_changed
+from .images import VARIANT_SIZES, variants_ready
+from .representation_cache import representation_cache
 from .validators import RecipesCreateUpdateValidator
 
+BATCH_MAX_SIZE = 100
+
 
 def validate_username(value):
     if re.search(r'[^\w\s]', value):
@@ -29,6 +39,52 @@ class Base64ImageField(serializers.ImageField):
         return super().to_internal_value(data)
 
 
+class ImageVariantsField(serializers.Field):
+    """
+    Ссылки на уменьшенные копии картинки рецепта:
+    {'small': {'webp': url, 'jpeg': url}, 'medium': {...}}.
+    Пока копии не готовы, возвращает None.
+    """
+    def __init__(self, **kwargs):
+        kwargs.setdefault('source', '*')
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        if not variants_ready(recipe):
+            return None
+        request = self.context.get('request')
+        representation = {}
+        for size_name in VARIANT_SIZES:
+            representation[size_name] = {}
+            for extension, path in recipe.image_variants[size_name].items():
+                url = default_storage.url(path)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                representation[size_name][extension] = url
+        return representation
+
+
+class BatchSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BATCH_MAX_SIZE,
+    )
+
+    def validate_ids(self, value):
+        return list(dict.fromkeys(value))
+
+
+class CookableSerializer(serializers.Serializer):
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BATCH_MAX_SIZE,
+    )
+    missing = serializers.IntegerField(min_value=0, default=0)
+
+
 class SetPasswordSerializer(serializers.Serializer):
     new_password = serializers.CharField(required=True)
     current_password = serializers.CharField(required=True)
@@ -49,6 +105,8 @@ class CustomUserSerializer(UserSerializer):
         model = User
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'subscribed'):
+            return obj.subscribed
         user = self.context['request'].user
         if user.is_anonymous or not user.id:
             return False
@@ -115,8 +173,34 @@ class TagsSerializer(serializers.ModelSerializer):
         model = Tags
 
 
+class IngredientPrimaryKeyField(serializers.PrimaryKeyRelatedField):
+    """Берёт ингредиенты из загруженных списком, если они там есть."""
+    loaded = None
+
+    def to_internal_value(self, data):
+        if self.loaded:
+            try:
+                return self.loaded[int(data)]
+            except (KeyError, TypeError, ValueError):
+                pass
+        return super().to_internal_value(data)
+
+
+class IngredientsM2MListSerializer(serializers.ListSerializer):
+    def to_internal_value(self, data):
+        ids = set()
+        if isinstance(data, list):
+            for item in data:
+                try:
+                    ids.add(int(item['id']))
+                except (KeyError, TypeError, ValueError):
+                    continue
+        self.child.fields['id'].loaded = Ingredients.objects.in_bulk(ids)
+        return super().to_internal_value(data)
+
+
 class IngredientsM2MSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredients.objects.all())
+    id = IngredientPrimaryKeyField(queryset=Ingredients.objects.all())
 
     class Meta:
         fields = (
@@ -124,6 +208,7 @@ class IngredientsM2MSerializer(serializers.ModelSerializer):
             'amount',
         )
         model = RecipeIngredient
+        list_serializer_class = IngredientsM2MListSerializer
 
 
 class RecipesCreateUpdateSerializer(serializers.ModelSerializer):
@@ -144,6 +229,7 @@ class RecipesCreateUpdateSerializer(serializers.ModelSerializer):
         model = Recipes
         validators = [RecipesCreateUpdateValidator()]
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         if not ingredients:
@@ -153,55 +239,119 @@ class RecipesCreateUpdateSerializer(serializers.ModelSerializer):
         tags = validated_data.pop('tags')
         author = self.context.get('request').user
         recipes = Recipes.objects.create(author=author, **validated_data)
-        recipes.save()
-        for ingredient in ingredients:
-            current_ingredient = ingredient.get('id')
-            amount = ingredient.get('amount')
-            recipes.ingredients.add(
-                current_ingredient,
-                through_defaults={
-                    'amount': amount,
-                }
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipes,
+                ingredient=ingredient['id'],
+                amount=ingredient['amount'],
             )
-
-        for tag in tags:
-            recipes.tags.add(tag)
-
+            for ingredient in ingredients
+        )
+        recipes.tags.set(tags)
+        Recipes.objects.filter(pk=recipes.pk).update_search_vector()
+        recipes_changed([recipes.pk])
         return recipes
 
+    @transaction.atomic
     def update(self, instance, validated_data):
+        Recipes.objects.lock([instance.pk])
         ingredients_data = validated_data.pop('ingredients', [])
-        tags_data = validated_data.pop('tags', [])
-        instance.name = validated_data.get('name', instance.name)
-        instance.text = validated_data.get('text', instance.text)
-        instance.image = validated_data.get('image', instance.image)
-        instance.cooking_time = validated_data.get(
-            'cooking_time',
-            instance.cooking_time,
+        tags_data = validated_data.pop('tags', None)
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        instance.save()
+        old_amounts, new_amounts = self.update_ingredients(
+            instance,
+            ingredients_data,
         )
-        instance.ingredients.clear()
-        for ingredient_data in ingredients_data:
-            ingredient = ingredient_data['id']
-            amount = ingredient_data['amount']
-            RecipeIngredient.objects.create(
+        if tags_data is not None:
+            instance.tags.set(tags_data)
+        ShoppingListTotal.objects.change_recipe(
+            instance,
+            old_amounts,
+            new_amounts,
+        )
+        ingredients_changed = old_amounts.keys() != new_amounts.keys()
+        if {'name', 'text'} & validated_data.keys() or ingredients_changed:
+            Recipes.objects.filter(pk=instance.pk).update_search_vector()
+        if ingredients_changed:
+            recipes_changed([instance.pk])
+        return instance
+
+    def update_ingredients(self, instance, ingredients_data):
+        """
+        Записывает только изменившиеся ингредиенты рецепта.
+        Возвращает старое и новое количество каждого ингредиента.
+        """
+        new_amounts = {
+            ingredient['id'].id: ingredient['amount']
+            for ingredient in ingredients_data
+        }
+        old_amounts = {}
+        changed = []
+        removed = []
+        for row in RecipeIngredient.objects.filter(recipe=instance):
+            if row.ingredient_id in old_amounts:
+                old_amounts[row.ingredient_id] += row.amount
+                removed.append(row.pk)
+                continue
+            old_amounts[row.ingredient_id] = row.amount
+            if row.ingredient_id not in new_amounts:
+                removed.append(row.pk)
+            elif row.amount != new_amounts[row.ingredient_id]:
+                row.amount = new_amounts[row.ingredient_id]
+                changed.append(row)
+        if removed:
+            RecipeIngredient.objects.filter(pk__in=removed).delete()
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
                 recipe=instance,
-                ingredient=ingredient,
-                amount=amount
+                ingredient_id=ingredient_id,
+                amount=amount,
             )
-        instance.tags.clear()
-        for tag_data in tags_data:
-            tag = tag_data
-            instance.tags.add(tag)
-        instance.save()
-        return instance
+            for ingredient_id, amount in new_amounts.items()
+            if ingredient_id not in old_amounts
+        )
+        return old_amounts, new_amounts
 
     def to_representation(self, instance):
+        user = self.context['request'].user
+        recipe = Recipes.objects.for_read(user).get(pk=instance.pk)
+        prefetch_for_read([recipe], user)
         return RecipesReadSerializer(
-            instance,
+            recipe,
             context=self.context
         ).data
 
 
+class RecipesReadListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        recipes = list(
+            data.all() if isinstance(data, models.Manager) else data
+        )
+        if self.context.get('representation_cache'):
+            representations = representation_cache.represent(
+                recipes,
+                self.child,
+            )
+        else:
+            representations = super().to_representation(recipes)
+        search = self.context.get('search')
+        if search:
+            self.add_search_snippets(recipes, representations, search)
+        return representations
+
+    def add_search_snippets(self, recipes, representations, search):
+        """Фрагменты с найденными словами только для рецептов страницы."""
+        headlines = Recipes.objects.filter(
+            pk__in=[recipe.pk for recipe in recipes],
+        ).search_headlines(search)
+        for recipe, data in zip(recipes, representations):
+            data['search_snippet'] = headlines.get(recipe.pk, '')
+
+
 class RecipesReadSerializer(serializers.ModelSerializer):
     tags = TagsSerializer(many=True)
     author = CustomUserSerializer(read_only=True)
@@ -211,6 +361,7 @@ class RecipesReadSerializer(serializers.ModelSerializer):
     )
     is_favorited = serializers.SerializerMethodField(read_only=True)
     image = Base64ImageField(required=False, allow_null=True)
+    image_variants = ImageVariantsField()
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
@@ -221,14 +372,35 @@ class RecipesReadSerializer(serializers.ModelSerializer):
             'ingredients',
             'name',
             'image',
+            'image_variants',
             'text',
             'cooking_time',
             'is_favorited',
             'is_in_shopping_cart',
         )
         model = Recipes
+        list_serializer_class = RecipesReadListSerializer
+
+    def to_representation(self, instance):
+        if self.context.get('representation_cache'):
+            return representation_cache.represent([instance], self)[0]
+        return super().to_representation(instance)
+
+    def to_shared_representation(self, instance):
+        """Часть представления, одинаковая для всех пользователей."""
+        data = super().to_representation(instance)
+        del data['is_favorited']
+        del data['is_in_shopping_cart']
+        return data
+
+    def get_author_subscribed(self, obj):
+        if hasattr(obj, 'author_subscribed'):
+            return obj.author_subscribed
+        return self.fields['author'].get_is_subscribed(obj.author)
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context['request'].user
         if user.is_anonymous or not user.id:
             return False
@@ -240,6 +412,8 @@ class RecipesReadSerializer(serializers.ModelSerializer):
         return is_favorited
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context['request'].user
         if user.is_anonymous or not user.id:
             return False
@@ -259,6 +433,7 @@ class RecipesFavoriteShortSerializer(serializers.ModelSerializer):
         required=False,
         allow_null=True
     )
+    image_variants = ImageVariantsField(source='recipe')
     cooking_time = serializers.IntegerField(source='recipe.cooking_time')
 
     class Meta:
@@ -266,6 +441,7 @@ class RecipesFavoriteShortSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'image_variants',
             'cooking_time',
         )
         model = FavoriteRecipe
@@ -279,6 +455,7 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
         required=False,
         allow_null=True,
     )
+    image_variants = ImageVariantsField(source='recipe')
     cooking_time = serializers.IntegerField(source='recipe.cooking_time')
 
     class Meta:
@@ -286,12 +463,14 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'image_variants',
             'cooking_time',
         )
         model = ShoppingCartRecipe
 
 
 class RecipesShortSerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
 
     class Meta:
         fields = (
@@ -299,6 +478,7 @@ class RecipesShortSerializer(serializers.ModelSerializer):
             'name',
             'cooking_time',
             'image',
+            'image_variants',
         )
         model = Recipes
 
@@ -311,7 +491,10 @@ class SubscriptionsSerializer(serializers.ModelSerializer):
     last_name = serializers.CharField(source='author.last_name')
     is_subscribed = serializers.SerializerMethodField(read_only=True)
     recipes = serializers.SerializerMethodField(read_only=True)
-    recipes_count = serializers.SerializerMethodField(read_only=True)
+    recipes_count = serializers.IntegerField(
+        source='author.recipes_count',
+        read_only=True,
+    )
 
     class Meta:
         fields = (
@@ -327,21 +510,47 @@ class SubscriptionsSerializer(serializers.ModelSerializer):
         model = Subscriptions
 
     def get_is_subscribed(self, obj):
-        user = obj.user
-        author = obj.author
-        is_subscribed = Subscriptions.objects.filter(
-            user=user,
-            author=author
-        ).exists()
-        return is_subscribed
+        return True
 
     def get_recipes(self, obj):
         author = obj.author
-        recipes = Recipes.objects.filter(author=author)
+        recipes = getattr(author, 'limited_recipes', None)
+        if recipes is None:
+            recipes = Recipes.objects.filter(author=author)
         serializer = RecipesShortSerializer(recipes, many=True)
         return serializer.data
 
-    def get_recipes_count(self, obj):
-        author = obj.author
-        recipes_count = Recipes.objects.filter(author=author).count()
-        return recipes_count
+
+class JobSerializer(serializers.ModelSerializer):
+    url = serializers.SerializerMethodField(read_only=True)
+    result_url = serializers.SerializerMethodField(read_only=True)
+
+    class Meta:
+        fields = (
+            'id',
+            'type',
+            'status',
+            'attempts',
+            'error',
+            'created',
+            'finished_at',
+            'result',
+            'url',
+            'result_url',
+        )
+        model = Job
+
+    def build_url(self, name, obj):
+        url = reverse(name, args=[obj.pk])
+        request = self.context.get('request')
+        if request is None:
+            return url
+        return request.build_absolute_uri(url)
+
+    def get_url(self, obj):
+        return self.build_url('jobs-detail', obj)
+
+    def get_result_url(self, obj):
+        if obj.status != Job.DONE or not obj.result_file:
+            return None
+        return self.build_url('jobs-result', obj)
@@ -0,0 +1,133 @@
+import csv
+import os
+from functools import lru_cache
+
+from django.conf import settings
+from django.db.models import F
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.translation import gettext as _
+from recipes.models import ShoppingListTotal
+from reportlab.pdfbase import pdfmetrics, ttfonts
+from reportlab.pdfgen import canvas
+
+FONT_NAME = 'Arial'
+FONT_PATH = os.path.join(settings.MEDIA_ROOT, 'arial.ttf')
+PAGE_TOP = 750
+PAGE_BOTTOM = 50
+LINE_HEIGHT = 20
+FILENAME = 'shopping_cart'
+
+
+@lru_cache(maxsize=None)
+def register_font():
+    """Регистрирует шрифт один раз на процесс."""
+    pdfmetrics.registerFont(ttfonts.TTFont(FONT_NAME, FONT_PATH))
+
+
+def shopping_list_totals(user):
+    return (
+        ShoppingListTotal.objects
+        .filter(user=user)
+        .values(
+            name=F('ingredient__name'),
+            measurement_unit=F('ingredient__measurement_unit'),
+            total_amount=F('amount'),
+        )
+        .order_by('name')
+    )
+
+
+def format_ingredient(ingredient):
+    return (
+        f"{ingredient['name']} "
+        f"({ingredient['measurement_unit']}) - "
+        f"{ingredient['total_amount']}"
+    )
+
+
+def attachment(response, extension):
+    response['Content-Disposition'] = (
+        'attachment; '
+        f'filename="{FILENAME}.{extension}"'
+    )
+    return response
+
+
+def render_pdf(ingredients):
+    register_font()
+    response = HttpResponse(content_type='application/pdf')
+    p = canvas.Canvas(response)
+    p.setFont(FONT_NAME, 14)
+    p.drawString(100, 800, _("Список продуктов"))
+    p.setFont(FONT_NAME, 12)
+    y = PAGE_TOP
+    for ingredient in ingredients:
+        if y < PAGE_BOTTOM:
+            p.showPage()
+            p.setFont(FONT_NAME, 12)
+            y = PAGE_TOP
+        p.drawString(100, y, format_ingredient(ingredient))
+        y -= LINE_HEIGHT
+    p.showPage()
+    p.save()
+    return attachment(response, 'pdf')
+
+
+class Echo:
+    """Псевдобуфер для csv.writer: возвращает строку вместо записи."""
+    def write(self, value):
+        return value
+
+
+def iter_csv(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(
+        [_('Ингредиент'), _('Единицы измерения'), _('Количество')]
+    )
+    for ingredient in ingredients:
+        yield writer.writerow([
+            ingredient['name'],
+            ingredient['measurement_unit'],
+            ingredient['total_amount'],
+        ])
+
+
+def iter_text(ingredients):
+    yield _("Список продуктов") + '\n\n'
+    for ingredient in ingredients:
+        yield format_ingredient(ingredient) + '\n'
+
+
+def render_csv(ingredients):
+    response = StreamingHttpResponse(
+        iter_csv(ingredients),
+        content_type='text/csv; charset=utf-8',
+    )
+    return attachment(response, 'csv')
+
+
+def render_text(ingredients):
+    response = StreamingHttpResponse(
+        iter_text(ingredients),
+        content_type='text/plain; charset=utf-8',
+    )
+    return attachment(response, 'txt')
+
+
+EXPORTERS = {
+    'pdf': render_pdf,
+    'csv': render_csv,
+    'txt': render_text,
+}
+
+
+def shopping_list_response(ingredients, export_format):
+    return EXPORTERS[export_format](ingredients)
+
+
+def render_shopping_list(ingredients, export_format):
+    """Содержимое файла списка покупок для фоновой задачи."""
+    response = shopping_list_response(ingredients, export_format)
+    if response.streaming:
+        return b''.join(response.streaming_content)
+    return response.content
@@ -0,0 +1,95 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from jobs.registry import enqueue
+from recipes.models import Ingredients, Recipes, Tags
+from users.models import User
+
+from .catalog import bump_version
+from .images import delete_variants, drop_stale_variants, needs_variants
+
+PROFILE_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+
+
+@receiver(post_save, sender=Ingredients)
+@receiver(post_delete, sender=Ingredients)
+@receiver(post_save, sender=Tags)
+@receiver(post_delete, sender=Tags)
+def catalog_changed(sender, **kwargs):
+    bump_version()
+
+
+@receiver(post_save, sender=Ingredients)
+def ingredient_changed(sender, instance, created, raw=False, **kwargs):
+    """Название ингредиента входит в поисковый вектор его рецептов."""
+    if not created and not raw:
+        enqueue('search_vectors', unique=True, ingredient_id=instance.pk)
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, created, update_fields, **kwargs):
+    """
+    Профиль автора входит в кешированное представление его рецептов.
+    Версии рецептов меняются, только если поля профиля действительно
+    изменились.
+    """
+    if created or not instance.changed_fields(
+        PROFILE_FIELDS & update_fields if update_fields else PROFILE_FIELDS
+    ):
+        return
+    Recipes.objects.filter(author=instance).update(version=F('version') + 1)
+
+
+@receiver(post_save, sender=Recipes)
+def recipe_image_changed(sender, instance, raw=False, **kwargs):
+    """
+    Новой картинке рецепта нужны уменьшенные копии. Задача создаётся
+    в той же транзакции, что и рецепт. Копии прежней картинки удаляются
+    из хранилища после коммита.
+    """
+    if not raw and needs_variants(instance):
+        enqueue(
+            'image_variants',
+            unique=True,
+            recipe_id=instance.pk,
+            name=instance.image.name,
+        )
+        if instance.image_variants:
+            transaction.on_commit(partial(
+                drop_stale_variants,
+                instance.pk,
+                instance.image_variants,
+            ))
+
+
+@receiver(post_save, sender=Recipes)
+def recipe_published(sender, instance, created, raw=False, **kwargs):
+    """
+    Новый рецепт раскладывается по лентам подписчиков автора
+    и увеличивает счётчик рецептов автора.
+    """
+    if created and not raw:
+        User.objects.filter(pk=instance.author_id).update(
+            recipes_count=F('recipes_count') + 1
+        )
+        enqueue('feed_fanout', recipe_id=instance.pk)
+
+
+@receiver(post_delete, sender=Recipes)
+def recipe_deleted(sender, instance, **kwargs):
+    User.objects.filter(pk=instance.author_id).update(
+        recipes_count=Greatest(F('recipes_count') - 1, 0)
+    )
+
+
+@receiver(post_delete, sender=Recipes)
+def recipe_variants_deleted(sender, instance, **kwargs):
+    """Копии картинки удалённого рецепта удаляются после коммита."""
+    if instance.image_variants:
+        transaction.on_commit(
+            partial(delete_variants, instance.image_variants)
+        )
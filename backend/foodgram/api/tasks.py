@@ -0,0 +1,58 @@
+from django.core.files.base import ContentFile
+from django.db import transaction
+from jobs.registry import task
+from recipes.models import FeedItem, Recipes, ShoppingListTotal
+
+from .images import update_variants
+from .shopping_list import FILENAME, render_shopping_list, shopping_list_totals
+
+
+@task('shopping_list', concurrency=2, timeout=5 * 60)
+def shopping_list(job):
+    export_format = job.payload['format']
+    ingredients = list(shopping_list_totals(job.user))
+    job.save_result_file(
+        f'{FILENAME}.{export_format}',
+        ContentFile(render_shopping_list(ingredients, export_format)),
+    )
+    return {'format': export_format, 'ingredients': len(ingredients)}
+
+
+@task('image_variants', concurrency=2, max_attempts=2, timeout=2 * 60)
+def image_variants(job):
+    return {
+        'updated': update_variants(
+            job.payload['recipe_id'],
+            job.payload['name'],
+        )
+    }
+
+
+@task('rebuild_shopping_lists', max_attempts=1, timeout=60 * 60)
+def rebuild_shopping_lists(job):
+    with transaction.atomic():
+        ShoppingListTotal.objects.rebuild()
+    return {}
+
+
+@task('feed_fanout', concurrency=2, timeout=10 * 60)
+def feed_fanout(job):
+    recipe = Recipes.objects.filter(pk=job.payload['recipe_id']).first()
+    if recipe is None:
+        return {'followers': 0}
+    return {'followers': FeedItem.objects.fan_out(recipe)}
+
+
+@task('search_vectors', timeout=30 * 60)
+def search_vectors(job):
+    recipes = Recipes.objects.filter(
+        recipe_ingredient__ingredient_id=job.payload['ingredient_id'],
+    )
+    return {'updated': recipes.update_search_vector()}
+
+
+@task('rebuild_feeds', max_attempts=1, timeout=60 * 60)
+def rebuild_feeds(job):
+    with transaction.atomic():
+        FeedItem.objects.rebuild()
+    return {}
@@ -1,39 +1,63 @@
-from collections import defaultdict
+import os
 
-from django.http import HttpResponse
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import FileResponse
 from django.shortcuts import get_object_or_404
-from django.utils.translation import ugettext as _
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
-from recipes.models import (FavoriteRecipe, Ingredients, RecipeIngredient,
-                            Recipes, ShoppingCartRecipe, Subscriptions, Tags,
-                            User)
-from reportlab.pdfbase import pdfmetrics, ttfonts
-from reportlab.pdfgen import canvas
-from rest_framework import permissions, status, viewsets
+from jobs.models import Job
+from jobs.registry import enqueue
+from recipes.models import (FavoriteRecipe, FeedItem, Ingredients, Recipes,
+                            ShoppingCartRecipe, ShoppingListTotal,
+                            Subscriptions, Tags, User, annotate_subscribed,
+                            recipe_amounts)
+from rest_framework import mixins, permissions, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 
+from .batch import add_links, remove_links
+from .catalog import catalog_cache
+from .cookable import recipe_index, recipes_changed
 from .filters import IngredientFilter, RecipeFilter
+from .ingredient_index import ingredient_index
+from .pagination import (FeedPagination, RecipesPagination,
+                         SubscriptionsPagination, UserPagination)
 from .permissions import IsUserReadOnly
-from .serializers import (CustomUserCreateSerializer, CustomUserSerializer,
-                          IngredientsSerializer, RecipesCreateUpdateSerializer,
+from .renderers import CSVRenderer, PDFRenderer, TextRenderer
+from .serializers import (BatchSerializer, CookableSerializer,
+                          CustomUserCreateSerializer, CustomUserSerializer,
+                          IngredientsSerializer, JobSerializer,
+                          RecipesCreateUpdateSerializer,
                           RecipesFavoriteShortSerializer,
                           RecipesReadSerializer, SetPasswordSerializer,
                           ShoppingCartSerializer, SubscriptionsSerializer,
                           TagsSerializer)
+from .shopping_list import shopping_list_response, shopping_list_totals
 
+FAVORITE_MESSAGES = {
+    'exists': 'Рецепт уже добавлен в избранное',
+    'not_found': 'Рецепт не найден',
+    'missing': 'Рецепт не найден в избранном',
+}
+SHOPPING_CART_MESSAGES = {
+    'exists': 'Рецепт уже добавлен в список продуктов',
+    'not_found': 'Рецепт не найден',
+    'missing': 'Рецепт не найден списке продуктов',
+}
+SUBSCRIBE_MESSAGES = {
+    'exists': 'Вы уже подписаны на этого автора',
+    'not_found': 'Пользователь не найден',
+    'missing': 'Вы не подписаны на этого автора',
+    'self': 'Нельзя подписаться на самого себя',
+}
 
-class UserPagination(PageNumberPagination):
-    page_size = 6
-    page_size_query_param = 'limit'
-    max_page_size = 100
 
-
-class SubscriptionsPagination(PageNumberPagination):
-    page_size_query_param = 'limit'
-    max_page_size = 100
+def batch_ids(request):
+    serializer = BatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    return serializer.validated_data['ids']
 
 
 class UserViewSet(UserViewSet):
@@ -41,41 +65,119 @@ class UserViewSet(UserViewSet):
     pagination_class = UserPagination
     permission_classes = [IsUserReadOnly]
 
+    def get_queryset(self):
+        return annotate_subscribed(super().get_queryset(), self.request.user)
+
+    def get_permissions(self):
+        if self.action == 'me':
+            return [permissions.IsAuthenticated()]
+        return super().get_permissions()
+
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return CustomUserSerializer
         return CustomUserCreateSerializer
 
-    @action(detail=True, methods=['post', 'delete'])
+    @action(
+        detail=True,
+        methods=['post', 'delete'],
+        permission_classes=[permissions.IsAuthenticated],
+    )
     def subscribe(self, request, id=None):
         if request.method == 'POST':
             author = get_object_or_404(User, id=id)
-            subscriptions, created = Subscriptions.objects.get_or_create(
-                user=request.user,
-                author=author,
+            if author == request.user:
+                return Response(
+                    {'message': SUBSCRIBE_MESSAGES['self']},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            with transaction.atomic():
+                if Subscriptions.objects.insert_ignore(
+                    user=request.user,
+                    author=author,
+                ):
+                    FeedItem.objects.follow(request.user, [author.id])
+            serializer = SubscriptionsSerializer(
+                Subscriptions(user=request.user, author=author)
             )
-            serializer = SubscriptionsSerializer(subscriptions)
             return Response(serializer.data)
         elif request.method == 'DELETE':
-            author = get_object_or_404(User, id=id)
-            Subscriptions.objects.filter(
-                user_id=request.user.id,
-                author_id=author.pk,
-            ).delete()
+            with transaction.atomic():
+                deleted, _ = Subscriptions.objects.filter(
+                    user_id=request.user.id,
+                    author_id=id,
+                ).delete()
+                if not deleted:
+                    return Response(
+                        {'message': SUBSCRIBE_MESSAGES['missing']},
+                        status=status.HTTP_404_NOT_FOUND
+                    )
+                FeedItem.objects.unfollow(request.user, [id])
             return Response(status=status.HTTP_204_NO_CONTENT)
 
-    @action(detail=False, methods=['get'])
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='subscribe/batch',
+        permission_classes=[permissions.IsAuthenticated],
+    )
+    def subscribe_batch(self, request):
+        ids = batch_ids(request)
+        with transaction.atomic():
+            if request.method == 'POST':
+                results, added = add_links(
+                    Subscriptions,
+                    request.user,
+                    'author',
+                    ids,
+                    User.objects.all(),
+                    SUBSCRIBE_MESSAGES,
+                    rejected={request.user.id: SUBSCRIBE_MESSAGES['self']},
+                )
+                FeedItem.objects.follow(request.user, added)
+            else:
+                results, removed = remove_links(
+                    Subscriptions,
+                    request.user,
+                    'author',
+                    ids,
+                    SUBSCRIBE_MESSAGES['missing'],
+                )
+                FeedItem.objects.unfollow(request.user, removed)
+        return Response({'results': results})
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[permissions.IsAuthenticated],
+    )
     def subscriptions(self, request):
-        subscriptions = Subscriptions.objects.filter(user=request.user)
+        recipes = Recipes.objects.only(
+            'id',
+            'name',
+            'image',
+            'image_variants',
+            'cooking_time',
+            'author_id',
+            'pub_date',
+        )
+        recipes_limit = request.query_params.get('recipes_limit', '')
+        if recipes_limit.isdigit():
+            recipes = recipes[:int(recipes_limit)]
+        subscriptions = (
+            Subscriptions.objects
+            .filter(user=request.user)
+            .select_related('author')
+            .prefetch_related(Prefetch(
+                'author__recipes',
+                queryset=recipes,
+                to_attr='limited_recipes',
+            ))
+            .order_by('id')
+        )
         paginator = SubscriptionsPagination()
         result_page = paginator.paginate_queryset(subscriptions, request)
         serializer = SubscriptionsSerializer(result_page, many=True)
-        recipes_limit = request.GET.get('recipes_limit', None)
-        if recipes_limit:
-            for subscription in serializer.data:
-                subscription['recipes'] = (
-                    subscription['recipes'][:int(recipes_limit)]
-                )
         return paginator.get_paginated_response(serializer.data)
 
     @action(detail=False, methods=['post'])
@@ -106,6 +208,12 @@ class IngredientsViewSet(viewsets.ModelViewSet):
     filterset_class = IngredientFilter
     search_fields = ('^name', )
 
+    @catalog_cache
+    def list(self, request, *args, **kwargs):
+        return Response(
+            ingredient_index.search(request.query_params.get('name', ''))
+        )
+
 
 class TagsViewSet(viewsets.ModelViewSet):
     pagination_class = None
@@ -113,121 +221,308 @@ class TagsViewSet(viewsets.ModelViewSet):
     permission_classes = (permissions.IsAuthenticatedOrReadOnly, )
     serializer_class = TagsSerializer
 
+    @catalog_cache
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
 
 class RecipesViewSet(viewsets.ModelViewSet):
     queryset = Recipes.objects.all()
-    pagination_class = UserPagination
+    pagination_class = RecipesPagination
     filter_backends = [DjangoFilterBackend]
     filterset_class = RecipeFilter
 
+    def get_queryset(self):
+        return Recipes.objects.for_read(self.request.user)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['representation_cache'] = self.request.method == 'GET'
+        context['search'] = self.request.query_params.get('search', '').strip()
+        return context
+
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return RecipesReadSerializer
         return RecipesCreateUpdateSerializer
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        Recipes.objects.lock([instance.pk])
+        ShoppingListTotal.objects.change_recipe(
+            instance,
+            recipe_amounts(instance),
+            {},
+        )
+        recipes_changed([instance.pk])
+        instance.delete()
+
     @action(detail=True, methods=['post', 'delete'])
     def favorite(self, request, pk=None):
         if request.method == 'POST':
             recipe = get_object_or_404(Recipes, pk=pk)
-            favorites = FavoriteRecipe.objects.filter(
-                user=request.user,
-                recipe=recipe,
-            )
-            if favorites.exists():
-                return Response(
-                    {'message': 'Рецепт уже добавлен в избранное'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            else:
-                favorite = FavoriteRecipe.objects.create(
+            with transaction.atomic():
+                if not FavoriteRecipe.objects.insert_ignore(
                     user=request.user,
                     recipe=recipe,
-                )
-                serializer = RecipesFavoriteShortSerializer(favorite)
-                return Response(serializer.data)
-        elif request.method == 'DELETE':
-            recipe = get_object_or_404(Recipes, pk=pk)
-            favorites = FavoriteRecipe.objects.filter(
-                user=request.user,
-                recipe=recipe,
+                ):
+                    return Response(
+                        {'message': FAVORITE_MESSAGES['exists']},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                Recipes.objects.filter(pk=pk).change_favorites_count(1)
+            serializer = RecipesFavoriteShortSerializer(
+                FavoriteRecipe(user=request.user, recipe=recipe)
             )
-            if favorites.exists():
-                favorites.delete()
-                return Response(status=status.HTTP_204_NO_CONTENT)
-            else:
-                return Response(
-                    {'message': 'Рецепт не найден в избранном'},
-                    status=status.HTTP_404_NOT_FOUND
-                )
+            return Response(serializer.data)
+        elif request.method == 'DELETE':
+            with transaction.atomic():
+                deleted, _ = FavoriteRecipe.objects.filter(
+                    user=request.user,
+                    recipe_id=pk,
+                ).delete()
+                if not deleted:
+                    return Response(
+                        {'message': FAVORITE_MESSAGES['missing']},
+                        status=status.HTTP_404_NOT_FOUND
+                    )
+                Recipes.objects.filter(pk=pk).change_favorites_count(-1)
+            return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=True, methods=['post', 'delete'])
     def shopping_cart(self, request, pk=None):
         if request.method == 'POST':
             recipe = get_object_or_404(Recipes, pk=pk)
-            cart = ShoppingCartRecipe.objects.filter(
-                user=request.user,
-                recipe=recipe,
+            with transaction.atomic():
+                if not ShoppingCartRecipe.objects.insert_ignore(
+                    user=request.user,
+                    recipe=recipe,
+                ):
+                    return Response(
+                        {'message': SHOPPING_CART_MESSAGES['exists']},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                ShoppingListTotal.objects.add_recipe(request.user, recipe)
+            serializer = ShoppingCartSerializer(
+                ShoppingCartRecipe(user=request.user, recipe=recipe)
             )
-            if cart.exists():
-                return Response(
-                    {'message': 'Рецепт уже добавлен в список продуктов'},
-                    status=status.HTTP_400_BAD_REQUEST
+            return Response(serializer.data)
+        elif request.method == 'DELETE':
+            with transaction.atomic():
+                deleted, _ = ShoppingCartRecipe.objects.filter(
+                    user=request.user,
+                    recipe_id=pk,
+                ).delete()
+                if not deleted:
+                    return Response(
+                        {'message': SHOPPING_CART_MESSAGES['missing']},
+                        status=status.HTTP_404_NOT_FOUND
+                    )
+                ShoppingListTotal.objects.remove_recipes(request.user, [pk])
+            return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='favorite/batch',
+        permission_classes=[permissions.IsAuthenticated],
+    )
+    def favorite_batch(self, request):
+        ids = batch_ids(request)
+        with transaction.atomic():
+            if request.method == 'POST':
+                results, added = add_links(
+                    FavoriteRecipe,
+                    request.user,
+                    'recipe',
+                    ids,
+                    Recipes.objects.all(),
+                    FAVORITE_MESSAGES,
                 )
+                if added:
+                    Recipes.objects.filter(
+                        pk__in=added,
+                    ).change_favorites_count(1)
             else:
-                cart = ShoppingCartRecipe.objects.create(
-                    user=request.user,
-                    recipe=recipe,
+                results, removed = remove_links(
+                    FavoriteRecipe,
+                    request.user,
+                    'recipe',
+                    ids,
+                    FAVORITE_MESSAGES['missing'],
                 )
-                serializer = ShoppingCartSerializer(cart)
-                return Response(serializer.data)
-        elif request.method == 'DELETE':
-            recipe = get_object_or_404(Recipes, pk=pk)
-            cart = ShoppingCartRecipe.objects.filter(
-                user=request.user,
-                recipe=recipe,
-            )
-            if cart.exists():
-                cart.delete()
-                return Response(status=status.HTTP_204_NO_CONTENT)
+                if removed:
+                    Recipes.objects.filter(
+                        pk__in=removed,
+                    ).change_favorites_count(-1)
+        return Response({'results': results})
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='shopping_cart/batch',
+        permission_classes=[permissions.IsAuthenticated],
+    )
+    def shopping_cart_batch(self, request):
+        ids = batch_ids(request)
+        with transaction.atomic():
+            if request.method == 'POST':
+                results, added = add_links(
+                    ShoppingCartRecipe,
+                    request.user,
+                    'recipe',
+                    ids,
+                    Recipes.objects.all(),
+                    SHOPPING_CART_MESSAGES,
+                )
+                ShoppingListTotal.objects.add_recipes(request.user, added)
             else:
-                return Response(
-                    {'message': 'Рецепт не найден списке продуктов'},
-                    status=status.HTTP_404_NOT_FOUND
+                results, removed = remove_links(
+                    ShoppingCartRecipe,
+                    request.user,
+                    'recipe',
+                    ids,
+                    SHOPPING_CART_MESSAGES['missing'],
                 )
+                ShoppingListTotal.objects.remove_recipes(
+                    request.user,
+                    removed,
+                )
+        return Response({'results': results})
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[permissions.IsAuthenticated],
+    )
+    def feed(self, request):
+        """
+        Рецепты авторов из подписок, новые первыми. Страница читается
+        из ленты пользователя, фильтры RecipeFilter применяются к ней
+        подзапросом.
+        """
+        items = FeedItem.objects.filter(user=request.user)
+        recipes = self.filter_queryset(Recipes.objects.all())
+        if recipes.query.has_filters():
+            items = items.filter(recipe__in=recipes.values('id'))
+        paginator = FeedPagination()
+        page = paginator.paginate_queryset(
+            items.only('recipe_id', 'pub_date'),
+            request,
+            view=self,
+        )
+        recipes = self.get_queryset().in_bulk(
+            [item.recipe_id for item in page]
+        )
+        serializer = RecipesReadSerializer(
+            [
+                recipes[item.recipe_id] for item in page
+                if item.recipe_id in recipes
+            ],
+            many=True,
+            context=self.get_serializer_context(),
+        )
+        return paginator.get_paginated_response(serializer.data)
 
     @action(detail=False, methods=['get'])
+    def cookable(self, request):
+        """
+        Рецепты, которые можно приготовить из ингредиентов ingredients,
+        докупив не больше missing остальных.
+        """
+        serializer = CookableSerializer(data={
+            'ingredients': request.query_params.getlist('ingredients'),
+            'missing': request.query_params.get('missing', 0),
+        })
+        serializer.is_valid(raise_exception=True)
+        paginator = UserPagination()
+        page = paginator.paginate_queryset(
+            recipe_index.match(**serializer.validated_data),
+            request,
+            view=self,
+        )
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in page]
+        )
+        page = [match for match in page if match[0] in recipes]
+        data = RecipesReadSerializer(
+            [recipes[recipe_id] for recipe_id, _, _ in page],
+            many=True,
+            context=self.get_serializer_context(),
+        ).data
+        for item, (_, covered, missing) in zip(data, page):
+            item['covered_ingredients'] = covered
+            item['missing_ingredients'] = missing
+        return paginator.get_paginated_response(data)
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[permissions.IsAuthenticated],
+        renderer_classes=[PDFRenderer, CSVRenderer, TextRenderer],
+    )
     def download_shopping_cart(self, request):
-        user = request.user
-        cart_items = ShoppingCartRecipe.objects.filter(user=user)
-        ingredients_totals = defaultdict(int)
-        for cart_item in cart_items:
-            recipe_ingredients = RecipeIngredient.objects.filter(
-                recipe=cart_item.recipe,
+        """
+        CSV и текст отдаются потоком. PDF для большого списка клиент
+        может попросить сформировать фоновой задачей (?async=1 или
+        заголовок Prefer: respond-async): тогда ответ 202 со ссылкой
+        на неё. Без этого файл формируется сразу.
+        """
+        export_format = request.accepted_renderer.format
+        ingredients_totals = shopping_list_totals(request.user)
+        if export_format == 'pdf' and self.prefers_async(request):
+            ingredients_totals = list(ingredients_totals)
+            if (
+                len(ingredients_totals)
+                > settings.SHOPPING_LIST_BACKGROUND_THRESHOLD
+            ):
+                job = enqueue(
+                    'shopping_list',
+                    user=request.user,
+                    unique=True,
+                    format=export_format,
+                )
+                serializer = JobSerializer(job, context={'request': request})
+                return Response(
+                    serializer.data,
+                    status=status.HTTP_202_ACCEPTED,
+                    headers={
+                        'Location': serializer.data['url'],
+                        'Preference-Applied': 'respond-async',
+                    },
+                    content_type='application/json',
+                )
+        return shopping_list_response(ingredients_totals, export_format)
+
+    @staticmethod
+    def prefers_async(request):
+        """Согласен ли клиент получить файл через фоновую задачу."""
+        if request.query_params.get('async', '').lower() in ('1', 'true'):
+            return True
+        preferences = request.headers.get('Prefer', '').lower()
+        return 'respond-async' in (
+            preference.split(';')[0].strip()
+            for preference in preferences.split(',')
+        )
+
+
+class JobsViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    serializer_class = JobSerializer
+    permission_classes = (permissions.IsAuthenticated, )
+
+    def get_queryset(self):
+        return Job.objects.filter(user=self.request.user)
+
+    @action(detail=True, methods=['get'])
+    def result(self, request, pk=None):
+        job = self.get_object()
+        if job.status != Job.DONE or not job.result_file:
+            return Response(
+                {'message': 'Результат задачи ещё не готов'},
+                status=status.HTTP_404_NOT_FOUND
             )
-            for recipe_ingredient in recipe_ingredients:
-                ingredient = recipe_ingredient.ingredient
-                ingredients_totals[ingredient.name] += recipe_ingredient.amount
-        MyFontObject = ttfonts.TTFont('Arial', './media/arial.ttf')
-        pdfmetrics.registerFont(MyFontObject)
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = (
-            'attachment; '
-            'filename="shopping_cart.pdf"'
+        return FileResponse(
+            job.result_file.open('rb'),
+            as_attachment=True,
+            filename=os.path.basename(job.result_file.name),
         )
-        p = canvas.Canvas(response)
-        p.setFont("Arial", 12)
-        p.setFont("Arial", 14)
-        p.drawString(100, 800, _("Cписок продуктов"))
-        p.setFont("Arial", 12)
-        y = 750
-        for ingredient, amount in ingredients_totals.items():
-            measurement_unit = Ingredients.objects.get(name=ingredient)
-            measurement_unit = measurement_unit.measurement_unit
-            p.drawString(
-                100,
-                y,
-                f"{ingredient} ({measurement_unit}) - {amount}")
-            y -= 20
-        p.showPage()
-        p.save()
-        return response
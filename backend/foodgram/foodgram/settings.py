@@ -35,6 +35,7 @@ INSTALLED_APPS = [
     'recipes.apps.RecipesConfig',
     'api.apps.ApiConfig',
     'users.apps.UsersConfig',
+    'jobs.apps.JobsConfig',
 ]
 
 MIDDLEWARE = [
@@ -80,6 +81,8 @@ DATABASES = {
     }
 }
 
+RECIPE_REPRESENTATION_CACHE = os.getenv('RECIPE_REPRESENTATION_CACHE')
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -134,3 +137,8 @@ DJOSER = {
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+SHOPPING_LIST_BACKGROUND_THRESHOLD = int(
+    os.getenv('SHOPPING_LIST_BACKGROUND_THRESHOLD', 200)
+)
+
+INGREDIENT_SEARCH_TYPOS = True
@@ -1,5 +1,5 @@
-from api.views import (IngredientsViewSet, RecipesViewSet, TagsViewSet,
-                       UserViewSet)
+from api.views import (IngredientsViewSet, JobsViewSet, RecipesViewSet,
+                       TagsViewSet, UserViewSet)
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
@@ -11,6 +11,7 @@ router_v1.register(r'tags', TagsViewSet, basename='tags')
 router_v1.register(r'recipes', RecipesViewSet, basename='recipes')
 router_v1.register(r'ingredients', IngredientsViewSet, basename='ingredients')
 router_v1.register(r'users', UserViewSet, basename='users')
+router_v1.register(r'jobs', JobsViewSet, basename='jobs')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
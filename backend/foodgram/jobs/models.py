@@ -0,0 +1,174 @@
+from datetime import timedelta
+
+from django.db import connections, models, transaction
+from django.utils import timezone
+from users.models import User
+
+RETRY_DELAY = 30
+
+
+class JobQuerySet(models.QuerySet):
+    def lock_type(self, type):
+        """
+        Блокирует тип задач до конца транзакции, чтобы обработчики
+        проверяли лимит одновременных задач типа по очереди. Нужна
+        только PostgreSQL: SQLite выполняет пишущие транзакции по одной.
+        """
+        connection = connections[self.db]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT pg_advisory_xact_lock(hashtext(%s))',
+                    [f'jobs.{type}'],
+                )
+
+    def claim(self, limits, worker):
+        """
+        Берёт первую готовую к запуску задачу одного из типов limits
+        и отмечает её выполняющейся, если задач этого типа выполняется
+        меньше limits[type]. Задачи, заблокированные другими
+        обработчиками, пропускаются.
+        """
+        types = set(limits)
+        with transaction.atomic(using=self.db):
+            while types:
+                job = (
+                    self.select_for_update(skip_locked=True)
+                    .filter(
+                        status=Job.QUEUED,
+                        type__in=types,
+                        run_after__lte=timezone.now(),
+                    )
+                    .order_by('run_after', 'id')
+                    .first()
+                )
+                if job is None:
+                    return None
+                self.lock_type(job.type)
+                running = self.filter(
+                    status=Job.RUNNING,
+                    type=job.type,
+                ).count()
+                if running >= limits[job.type]:
+                    types.discard(job.type)
+                    continue
+                job.status = Job.RUNNING
+                job.attempts += 1
+                job.started_at = timezone.now()
+                job.worker = worker
+                job.save(update_fields=[
+                    'status', 'attempts', 'started_at', 'worker',
+                ])
+                return job
+        return None
+
+    def stale(self, type, timeout):
+        """Задачи, которые выполняются дольше timeout секунд."""
+        return self.filter(
+            type=type,
+            status=Job.RUNNING,
+            started_at__lt=timezone.now() - timedelta(seconds=timeout),
+        )
+
+    def purge(self, age):
+        """Удаляет завершённые задачи старше age секунд вместе с файлами."""
+        jobs = self.filter(
+            status__in=(Job.DONE, Job.FAILED),
+            finished_at__lt=timezone.now() - timedelta(seconds=age),
+        )
+        for job in jobs.exclude(result_file=''):
+            job.result_file.delete(save=False)
+        return jobs.delete()
+
+
+class Job(models.Model):
+    """Фоновая задача в очереди, которую выполняет команда run_jobs."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    )
+
+    type = models.CharField('Тип', max_length=64)
+    payload = models.JSONField('Параметры', default=dict, blank=True)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='jobs',
+        verbose_name='Пользователь',
+        null=True,
+        blank=True,
+    )
+    status = models.CharField(
+        'Статус',
+        max_length=16,
+        choices=STATUS_CHOICES,
+        default=QUEUED,
+    )
+    attempts = models.PositiveSmallIntegerField('Попытки', default=0)
+    max_attempts = models.PositiveSmallIntegerField(
+        'Максимум попыток',
+        default=3,
+    )
+    run_after = models.DateTimeField('Запустить после', default=timezone.now)
+    created = models.DateTimeField('Создана', auto_now_add=True)
+    started_at = models.DateTimeField('Запущена', null=True, blank=True)
+    finished_at = models.DateTimeField('Завершена', null=True, blank=True)
+    worker = models.CharField('Обработчик', max_length=64, blank=True)
+    result = models.JSONField('Результат', null=True, blank=True)
+    result_file = models.FileField(
+        'Файл результата',
+        upload_to='jobs/',
+        blank=True,
+    )
+    error = models.TextField('Ошибка', blank=True)
+
+    objects = JobQuerySet.as_manager()
+
+    class Meta:
+        ordering = ('-id', )
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        indexes = [
+            models.Index(
+                fields=['status', 'run_after'],
+                name='jobs_status_run_after_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.type} #{self.pk}'
+
+    def save_result_file(self, name, content):
+        """Сохраняет файл результата, не трогая остальные поля задачи."""
+        self.result_file.save(name, content, save=False)
+        Job.objects.filter(pk=self.pk).update(
+            result_file=self.result_file.name
+        )
+
+    def finish(self, result):
+        self.status = Job.DONE
+        self.result = result
+        self.error = ''
+        self.finished_at = timezone.now()
+        self.save(update_fields=['status', 'result', 'error', 'finished_at'])
+
+    def fail(self, error):
+        """Повторяет задачу с растущей задержкой, пока есть попытки."""
+        self.error = error
+        if self.attempts < self.max_attempts:
+            self.status = Job.QUEUED
+            self.run_after = timezone.now() + timedelta(
+                seconds=RETRY_DELAY * 2 ** (self.attempts - 1)
+            )
+        else:
+            self.status = Job.FAILED
+            self.finished_at = timezone.now()
+        self.save(
+            update_fields=['status', 'error', 'run_after', 'finished_at']
+        )
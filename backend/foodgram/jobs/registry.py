@@ -0,0 +1,60 @@
+from django.db import connections
+
+from .models import Job
+
+TASKS = {}
+
+
+class Task:
+    def __init__(self, name, func, concurrency, max_attempts, timeout):
+        self.name = name
+        self.func = func
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+
+
+def task(name, concurrency=1, max_attempts=3, timeout=600):
+    """
+    Регистрирует функцию как тип фоновой задачи. Функция получает
+    задачу и возвращает результат, который можно сохранить в JSON.
+    concurrency ограничивает число одновременно выполняющихся задач
+    этого типа, timeout - время, после которого задача считается
+    зависшей.
+    """
+    def decorator(func):
+        TASKS[name] = Task(name, func, concurrency, max_attempts, timeout)
+        return func
+    return decorator
+
+
+def enqueue(job_type, user=None, unique=False, **payload):
+    """
+    Ставит задачу в очередь. С unique=True возвращает уже ожидающую
+    задачу с теми же параметрами, если она есть.
+    """
+    if job_type not in TASKS:
+        raise ValueError(f'Unknown job type: {job_type}')
+    if unique:
+        job = Job.objects.filter(
+            type=job_type,
+            user=user,
+            payload=payload,
+            status=Job.QUEUED,
+        ).first()
+        if job is not None:
+            return job
+    return Job.objects.create(
+        type=job_type,
+        user=user,
+        payload=payload,
+        max_attempts=TASKS[job_type].max_attempts,
+    )
+
+
+def execute(job_id):
+    job = Job.objects.select_related('user').get(pk=job_id)
+    try:
+        return TASKS[job.type].func(job)
+    finally:
+        connections.close_all()
@@ -0,0 +1,14 @@
+"""
+Точки входа для процессов пула run_jobs. Процессы запускаются через
+spawn, поэтому модели импортируются только после django.setup().
+"""
+import django
+
+
+def setup():
+    django.setup()
+
+
+def run_job(job_id):
+    from .registry import execute
+    return execute(job_id)
@@ -0,0 +1,61 @@
+# Generated by Django 4.2.5 on 2026-10-18 15:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def insert_totals(schema_editor, ShoppingListTotal, rows):
+    """Вставляет итоги rows (user_id, ingredient_id, amount) одним запросом."""
+    quote = schema_editor.quote_name
+    sql, params = rows.query.get_compiler(
+        connection=schema_editor.connection,
+    ).as_sql()
+    schema_editor.execute(
+        f'INSERT INTO {quote(ShoppingListTotal._meta.db_table)} '
+        f'({quote("user_id")}, {quote("ingredient_id")}, {quote("amount")}) '
+        f'{sql}',
+        params,
+    )
+
+
+def fill_totals(apps, schema_editor):
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ShoppingListTotal = apps.get_model('recipes', 'ShoppingListTotal')
+    rows = (
+        RecipeIngredient.objects
+        .filter(recipe__added_to_cart_by__isnull=False)
+        .values_list('recipe__added_to_cart_by__user_id', 'ingredient_id')
+        .annotate(models.Sum('amount'))
+        .order_by()
+    )
+    insert_totals(schema_editor, ShoppingListTotal, rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0008_alter_favoriterecipe_recipe_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingListTotal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.IntegerField(default=0, verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list_totals', to='recipes.ingredients', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list_totals', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'итог списка покупок',
+                'verbose_name_plural': 'Итоги списков покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppinglisttotal',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_shopping_list_total'),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
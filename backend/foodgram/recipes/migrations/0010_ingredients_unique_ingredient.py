@@ -0,0 +1,71 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+def merge_duplicates(apps, schema_editor):
+    Ingredients = apps.get_model('recipes', 'Ingredients')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ShoppingListTotal = apps.get_model('recipes', 'ShoppingListTotal')
+    duplicates = (
+        Ingredients.objects
+        .values('name', 'measurement_unit')
+        .annotate(keep_id=models.Min('id'), count=models.Count('id'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        extra_ids = list(
+            Ingredients.objects
+            .filter(
+                name=duplicate['name'],
+                measurement_unit=duplicate['measurement_unit'],
+            )
+            .exclude(id=duplicate['keep_id'])
+            .values_list('id', flat=True)
+        )
+        # Если в рецепте уже есть оставляемый ингредиент, количество
+        # дубликата прибавляется к нему, а строка дубликата удаляется.
+        kept_rows = {
+            row.recipe_id: row
+            for row in RecipeIngredient.objects.filter(
+                ingredient_id=duplicate['keep_id'],
+            ).order_by('-id')
+        }
+        for row in RecipeIngredient.objects.filter(
+            ingredient_id__in=extra_ids,
+        ).order_by('id'):
+            kept = kept_rows.get(row.recipe_id)
+            if kept is None:
+                row.ingredient_id = duplicate['keep_id']
+                row.save(update_fields=['ingredient_id'])
+                kept_rows[row.recipe_id] = row
+            else:
+                kept.amount += row.amount
+                kept.save(update_fields=['amount'])
+                row.delete()
+        for total in ShoppingListTotal.objects.filter(
+            ingredient_id__in=extra_ids,
+        ):
+            kept, _ = ShoppingListTotal.objects.get_or_create(
+                user_id=total.user_id,
+                ingredient_id=duplicate['keep_id'],
+            )
+            kept.amount += total.amount
+            kept.save()
+            total.delete()
+        Ingredients.objects.filter(id__in=extra_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_shoppinglisttotal'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredients',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
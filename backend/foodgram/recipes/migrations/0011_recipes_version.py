@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_ingredients_unique_ingredient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipes',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Версия'),
+        ),
+    ]
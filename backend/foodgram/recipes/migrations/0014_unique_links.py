@@ -0,0 +1,90 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:10
+
+from django.db import migrations, models
+
+
+def delete_duplicates(model, fields):
+    """Оставляет одну строку из каждой группы одинаковых fields."""
+    duplicates = (
+        model.objects
+        .values(*fields)
+        .annotate(keep_id=models.Min('id'), count=models.Count('id'))
+        .filter(count__gt=1)
+    )
+    affected = set()
+    for duplicate in duplicates:
+        model.objects.filter(
+            **{field: duplicate[field] for field in fields}
+        ).exclude(id=duplicate['keep_id']).delete()
+        affected.add(duplicate[fields[0]])
+    return affected
+
+
+def insert_totals(schema_editor, ShoppingListTotal, rows):
+    """Вставляет итоги rows (user_id, ingredient_id, amount) одним запросом."""
+    quote = schema_editor.quote_name
+    sql, params = rows.query.get_compiler(
+        connection=schema_editor.connection,
+    ).as_sql()
+    schema_editor.execute(
+        f'INSERT INTO {quote(ShoppingListTotal._meta.db_table)} '
+        f'({quote("user_id")}, {quote("ingredient_id")}, {quote("amount")}) '
+        f'{sql}',
+        params,
+    )
+
+
+def remove_duplicate_links(apps, schema_editor):
+    FavoriteRecipe = apps.get_model('recipes', 'FavoriteRecipe')
+    ShoppingCartRecipe = apps.get_model('recipes', 'ShoppingCartRecipe')
+    Subscriptions = apps.get_model('recipes', 'Subscriptions')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ShoppingListTotal = apps.get_model('recipes', 'ShoppingListTotal')
+
+    delete_duplicates(FavoriteRecipe, ['user_id', 'recipe_id'])
+    delete_duplicates(Subscriptions, ['user_id', 'author_id'])
+    Subscriptions.objects.filter(author_id=models.F('user_id')).delete()
+
+    users = delete_duplicates(ShoppingCartRecipe, ['user_id', 'recipe_id'])
+    if not users:
+        return
+    ShoppingListTotal.objects.filter(user_id__in=users).delete()
+    insert_totals(
+        schema_editor,
+        ShoppingListTotal,
+        RecipeIngredient.objects
+        .filter(recipe__added_to_cart_by__user_id__in=users)
+        .values_list('recipe__added_to_cart_by__user_id', 'ingredient_id')
+        .annotate(models.Sum('amount'))
+        .order_by(),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_recipes_image_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            remove_duplicate_links,
+            migrations.RunPython.noop,
+        ),
+        migrations.AddConstraint(
+            model_name='favoriterecipe',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_favorite_recipe'),
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcartrecipe',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_shoppingcart_recipe'),
+        ),
+        migrations.AddConstraint(
+            model_name='subscriptions',
+            constraint=models.CheckConstraint(check=models.Q(('author', models.F('user')), _negated=True), name='author_not_equals_user'),
+        ),
+        migrations.AddConstraint(
+            model_name='subscriptions',
+            constraint=models.UniqueConstraint(fields=('author', 'user'), name='unique_subscription'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.5 on 2026-10-18 19:40
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def fill_search_vectors(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Recipes = apps.get_model('recipes', 'Recipes')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ingredient_names = Subquery(
+        RecipeIngredient.objects
+        .filter(recipe=OuterRef('pk'))
+        .values('recipe')
+        .annotate(names=StringAgg('ingredient__name', ' '))
+        .values('names')
+    )
+    Recipes.objects.update(search_vector=(
+        SearchVector('name', weight='A', config='russian')
+        + SearchVector(ingredient_names, weight='B', config='russian')
+        + SearchVector('text', weight='C', config='russian')
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_feeditem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipes',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipes',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='recipes_search_vector_idx'),
+        ),
+    ]
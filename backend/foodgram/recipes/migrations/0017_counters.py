@@ -0,0 +1,49 @@
+# Generated by Django 4.2.5 on 2026-10-18 20:15
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def count_of(model, field):
+    return Coalesce(
+        models.Subquery(
+            model.objects
+            .filter(**{field: models.OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(count=models.Count('pk'))
+            .values('count')
+        ),
+        0,
+    )
+
+
+def fill_counters(apps, schema_editor):
+    Recipes = apps.get_model('recipes', 'Recipes')
+    FavoriteRecipe = apps.get_model('recipes', 'FavoriteRecipe')
+    User = apps.get_model('users', 'User')
+    Recipes.objects.update(
+        favorites_count=count_of(FavoriteRecipe, 'recipe')
+    )
+    User.objects.update(recipes_count=count_of(Recipes, 'author'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_user_recipes_count'),
+        ('recipes', '0016_recipes_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipes',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавления в избранное'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipes',
+            index=models.Index(fields=['-favorites_count', '-pub_date', '-id'], name='recipes_popular_idx'),
+        ),
+    ]
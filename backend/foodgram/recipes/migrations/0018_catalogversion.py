@@ -0,0 +1,35 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:36
+
+import uuid
+
+from django.db import migrations, models
+
+
+def create_version(apps, schema_editor):
+    CatalogVersion = apps.get_model('recipes', 'CatalogVersion')
+    CatalogVersion.objects.using(schema_editor.connection.alias).create(
+        pk=1,
+        version=uuid.uuid4().hex,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0017_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.CharField(max_length=32, verbose_name='Версия')),
+            ],
+            options={
+                'verbose_name': 'Версия справочников',
+                'verbose_name_plural': 'Версии справочников',
+            },
+        ),
+        migrations.RunPython(create_version, migrations.RunPython.noop),
+    ]
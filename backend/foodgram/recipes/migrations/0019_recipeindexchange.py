@@ -0,0 +1,24 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0018_catalogversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeIndexChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('recipe_ids', models.JSONField(verbose_name='Id рецептов')),
+            ],
+            options={
+                'verbose_name': 'изменение ингредиентов рецептов',
+                'verbose_name_plural': 'Журнал изменений ингредиентов рецептов',
+            },
+        ),
+    ]
@@ -1,10 +1,25 @@
+from itertools import islice
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import (SearchHeadline, SearchQuery,
+                                            SearchRank, SearchVector,
+                                            SearchVectorField)
 from django.core.validators import MinValueValidator, RegexValidator
-from django.db import models
-from django.db.models import constraints
-from users.models import User
+from django.db import connections, models, transaction
+from django.db.models import (Case, Count, Exists, F, OuterRef, Prefetch,
+                              Subquery, Sum, Value, When, constraints,
+                              prefetch_related_objects)
+from django.db.models.constants import OnConflict
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.sql import InsertQuery
+from users.models import User, loaded_fields
 
 from .constants import COLOR_MAX_LENGTH, NAME_MAX_LENGTH
 
+SEARCH_CONFIG = 'russian'
+FEED_BATCH_SIZE = 10000
+
 
 class Ingredients(models.Model):
     """Модель ингредиента."""
@@ -21,6 +36,12 @@ class Ingredients(models.Model):
     class Meta:
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient'
+            )
+        ]
 
     def __str__(self):
         return self.name
@@ -49,6 +70,147 @@ class Tags(models.Model):
         return self.name
 
 
+class CatalogVersion(models.Model):
+    """
+    Версия справочников тегов и ингредиентов. Строка в базе общая для
+    всех процессов и контейнеров и, в отличие от записи в кеше, не
+    вытесняется.
+    """
+    version = models.CharField('Версия', max_length=32)
+
+    class Meta:
+        verbose_name = 'Версия справочников'
+        verbose_name_plural = 'Версии справочников'
+
+    def __str__(self):
+        return self.version
+
+
+def annotate_subscribed(users, user):
+    """Отмечает пользователей, на которых подписан user."""
+    if user.is_anonymous:
+        return users.annotate(subscribed=Value(False))
+    return users.annotate(subscribed=Exists(Subscriptions.objects.filter(
+        user=user,
+        author=OuterRef('pk'),
+    )))
+
+
+class RecipesQuerySet(models.QuerySet):
+    def with_user_flags(self, user):
+        """
+        Отмечает рецепты из избранного и корзины пользователя
+        и рецепты авторов, на которых он подписан.
+        """
+        if user.is_anonymous:
+            return self.annotate(
+                is_favorited=Value(False),
+                is_in_shopping_cart=Value(False),
+                author_subscribed=Value(False),
+            )
+        return self.annotate(
+            is_favorited=Exists(FavoriteRecipe.objects.filter(
+                user=user,
+                recipe=OuterRef('pk'),
+            )),
+            is_in_shopping_cart=Exists(ShoppingCartRecipe.objects.filter(
+                user=user,
+                recipe=OuterRef('pk'),
+            )),
+            author_subscribed=Exists(Subscriptions.objects.filter(
+                user=user,
+                author=OuterRef('author'),
+            )),
+        )
+
+    def for_read(self, user):
+        """
+        Рецепты для выдачи пользователю. Автора, теги и ингредиенты
+        подгружает prefetch_for_read, и только для рецептов,
+        которых нет в кеше представлений.
+        """
+        return self.with_user_flags(user).defer('search_vector')
+
+    def change_favorites_count(self, delta):
+        return self.update(
+            favorites_count=Greatest(F('favorites_count') + delta, 0)
+        )
+
+    def lock(self, recipe_ids):
+        """
+        Блокирует строки рецептов до конца транзакции. Изменение
+        ингредиентов рецепта и изменение корзин с этим рецептом идут
+        по очереди, и итоги списков покупок считаются по актуальному
+        количеству ингредиентов.
+        """
+        return list(
+            self.select_for_update(no_key=True)
+            .filter(pk__in=recipe_ids)
+            .order_by('pk')
+            .values_list('pk', flat=True)
+        )
+
+    def popular(self):
+        return self.order_by('-favorites_count', '-pub_date', '-id')
+
+    def full_text_search(self):
+        return connections[self.db].vendor == 'postgresql'
+
+    def search(self, text):
+        """
+        Полнотекстовый поиск, самые подходящие рецепты первыми.
+        Без PostgreSQL ищет подстроку в названии.
+        """
+        if not self.full_text_search():
+            return self.filter(name__icontains=text)
+        query = search_query(text)
+        return self.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query),
+        ).order_by('-search_rank', '-pub_date', '-id')
+
+    def search_headlines(self, text):
+        """Фрагменты описаний рецептов с выделенными словами запроса."""
+        if not self.full_text_search():
+            return {}
+        return dict(
+            self.annotate(headline=SearchHeadline(
+                'text',
+                search_query(text),
+                config=SEARCH_CONFIG,
+                start_sel='<b>',
+                stop_sel='</b>',
+                max_words=30,
+                min_words=10,
+            ))
+            .order_by()
+            .values_list('id', 'headline')
+        )
+
+    def update_search_vector(self):
+        """
+        Пересчитывает поисковый вектор по названию, названиям
+        ингредиентов и тексту рецепта.
+        """
+        if not self.full_text_search():
+            return 0
+        ingredient_names = Subquery(
+            RecipeIngredient.objects
+            .filter(recipe=OuterRef('pk'))
+            .values('recipe')
+            .annotate(names=StringAgg('ingredient__name', ' '))
+            .values('names')
+        )
+        return self.update(search_vector=(
+            SearchVector('name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector(ingredient_names, weight='B', config=SEARCH_CONFIG)
+            + SearchVector('text', weight='C', config=SEARCH_CONFIG)
+        ))
+
+
+def search_query(text):
+    return SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+
+
 class Recipes(models.Model):
     """Модель рецепта."""
     author = models.ForeignKey(
@@ -67,6 +229,12 @@ class Recipes(models.Model):
         null=True,
         default=None
     )
+    image_variants = models.JSONField(
+        'Уменьшенные копии картинки',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
     text = models.TextField('Текст описания блюда')
     ingredients = models.ManyToManyField(
         Ingredients,
@@ -86,15 +254,63 @@ class Recipes(models.Model):
                 message='Время приготовления должно быть больше 0'),)
     )
     pub_date = models.DateTimeField(auto_now_add=True)
+    version = models.PositiveIntegerField(
+        'Версия',
+        default=0,
+        editable=False,
+    )
+    search_vector = SearchVectorField(
+        'Поисковый вектор',
+        null=True,
+        editable=False,
+    )
+    favorites_count = models.PositiveIntegerField(
+        'Добавления в избранное',
+        default=0,
+        editable=False,
+    )
+
+    objects = RecipesQuerySet.as_manager()
 
     class Meta:
         ordering = ('-pub_date', )
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipes_pub_date_id_idx',
+            ),
+            GinIndex(
+                fields=['search_vector'],
+                name='recipes_search_vector_idx',
+            ),
+            models.Index(
+                fields=['-favorites_count', '-pub_date', '-id'],
+                name='recipes_popular_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        """
+        Каждое изменение рецепта увеличивает его версию. Счётчик
+        избранного и поисковый вектор пишутся отдельными запросами
+        и при сохранении рецепта не перезаписываются.
+        """
+        if self._state.adding:
+            return super().save(*args, **kwargs)
+        if kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = loaded_fields(
+                self,
+                {'favorites_count', 'search_vector'},
+            )
+        self.version = F('version') + 1
+        super().save(*args, **kwargs)
+        self.refresh_from_db(fields=['version'])
+
 
 class RecipeIngredient(models.Model):
     """Промежуточная модель для связи рецептов и ингредиентов."""
@@ -125,6 +341,87 @@ class RecipeIngredient(models.Model):
         return f"{self.recipe.name} - {self.ingredient.name}"
 
 
+class LinkQuerySet(models.QuerySet):
+    def insert_ignore(self, **fields):
+        """
+        Добавляет строку одним INSERT, пропуская нарушения уникальности
+        (ON CONFLICT DO NOTHING). Возвращает True, если строка добавлена.
+        """
+        obj = self.model(**fields)
+        query = InsertQuery(self.model, on_conflict=OnConflict.IGNORE)
+        query.insert_values(
+            [
+                field for field in self.model._meta.concrete_fields
+                if not field.primary_key
+            ],
+            [obj],
+        )
+        [(sql, params)] = query.get_compiler(using=self.db).as_sql()
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.rowcount == 1
+
+    def insert_returning(self, user, field, ids):
+        """
+        Связывает пользователя с объектами ids одним
+        INSERT ... ON CONFLICT DO NOTHING RETURNING. Возвращает id
+        объектов, связи с которыми действительно добавлены.
+        """
+        connection = connections[self.db]
+        if not connection.features.can_return_rows_from_bulk_insert:
+            return [
+                pk for pk in ids
+                if self.insert_ignore(user=user, **{f'{field}_id': pk})
+            ]
+        objs = [self.model(user=user, **{f'{field}_id': pk}) for pk in ids]
+        if not objs:
+            return []
+        query = InsertQuery(self.model, on_conflict=OnConflict.IGNORE)
+        query.insert_values(
+            [
+                model_field
+                for model_field in self.model._meta.concrete_fields
+                if not model_field.primary_key
+            ],
+            objs,
+        )
+        compiler = query.get_compiler(using=self.db)
+        compiler.returning_fields = [self.model._meta.get_field(field)]
+        [(sql, params)] = compiler.as_sql()
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [pk for pk, in cursor.fetchall()]
+
+    def delete_returning(self, user, field, ids):
+        """
+        Удаляет связи пользователя с объектами ids одним
+        DELETE ... RETURNING. Возвращает id объектов, связи с которыми
+        действительно удалены.
+        """
+        if not ids:
+            return []
+        connection = connections[self.db]
+        if not connection.features.can_return_columns_from_insert:
+            links = self.filter(user=user, **{f'{field}__in': ids})
+            removed = list(
+                links.select_for_update().values_list(field, flat=True)
+            )
+            links.delete()
+            return removed
+        quote = connection.ops.quote_name
+        opts = self.model._meta
+        column = quote(opts.get_field(field).column)
+        sql = (
+            f'DELETE FROM {quote(opts.db_table)} '
+            f'WHERE {quote(opts.get_field("user").column)} = %s '
+            f'AND {column} IN ({", ".join(["%s"] * len(ids))}) '
+            f'RETURNING {column}'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [user.pk, *ids])
+            return [pk for pk, in cursor.fetchall()]
+
+
 class FavoriteRecipe(models.Model):
     """Модель для любимых блюд."""
     user = models.ForeignKey(
@@ -140,6 +437,8 @@ class FavoriteRecipe(models.Model):
         verbose_name='Рецепт'
     )
 
+    objects = LinkQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'избранный рецепт'
         verbose_name_plural = 'Избранное'
@@ -169,6 +468,8 @@ class ShoppingCartRecipe(models.Model):
         verbose_name='Рецепт'
     )
 
+    objects = LinkQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'продукт'
         verbose_name_plural = 'Список покупок'
@@ -195,6 +496,8 @@ class Subscriptions(models.Model):
         related_name='follower'
     )
 
+    objects = LinkQuerySet.as_manager()
+
     class Meta:
         verbose_name_plural = 'Подписка'
         constraints = [
@@ -210,3 +513,387 @@ class Subscriptions(models.Model):
 
     def __str__(self):
         return f"{self.user.username} подписан на {self.author.username}"
+
+
+def count_of(model, field):
+    """Число строк model, ссылающихся на объект через field."""
+    return Coalesce(
+        Subquery(
+            model.objects
+            .filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(count=Count('pk'))
+            .values('count')
+        ),
+        0,
+    )
+
+
+def reconcile_counters(fix=True):
+    """
+    Сверяет счётчики избранного у рецептов и рецептов у пользователей
+    с таблицами связей. Возвращает число расходящихся строк для каждого
+    счётчика и, если fix, исправляет их.
+    """
+    counters = (
+        (Recipes, 'favorites_count', count_of(FavoriteRecipe, 'recipe')),
+        (User, 'recipes_count', count_of(Recipes, 'author')),
+    )
+    mismatches = {}
+    for model, field, actual in counters:
+        stale = (
+            model.objects
+            .annotate(actual=actual)
+            .exclude(**{field: F('actual')})
+        )
+        mismatches[field] = stale.count()
+        if fix and mismatches[field]:
+            model.objects.filter(pk__in=stale.values('pk')).update(
+                **{field: actual}
+            )
+    return mismatches
+
+
+def prefetch_for_read(recipes, user):
+    """Подгружает автора, теги и ингредиенты рецептов одним пакетом."""
+    prefetch_related_objects(
+        recipes,
+        Prefetch(
+            'author',
+            queryset=annotate_subscribed(User.objects.all(), user),
+        ),
+        'tags',
+        Prefetch(
+            'recipe_ingredient',
+            queryset=RecipeIngredient.objects.select_related('ingredient'),
+        ),
+    )
+
+
+def recipe_amounts(recipe):
+    """Возвращает количество каждого ингредиента рецепта."""
+    return recipes_amounts([recipe.pk])
+
+
+def recipes_amounts(recipe_ids):
+    """Возвращает суммарное количество ингредиентов рецептов."""
+    return dict(
+        RecipeIngredient.objects
+        .filter(recipe_id__in=recipe_ids)
+        .values('ingredient_id')
+        .annotate(total_amount=Sum('amount'))
+        .values_list('ingredient_id', 'total_amount')
+    )
+
+
+def insert_from_select(model, fields, queryset):
+    """
+    Вставляет в таблицу model строки queryset одним INSERT ... SELECT.
+    Столбцы queryset должны идти в порядке fields.
+    """
+    connection = connections[queryset.db]
+    quote = connection.ops.quote_name
+    columns = ', '.join(
+        quote(model._meta.get_field(field).column) for field in fields
+    )
+    sql, params = queryset.query.get_compiler(using=queryset.db).as_sql()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(model._meta.db_table)} ({columns}) {sql}',
+            params,
+        )
+
+
+class ShoppingListTotalManager(models.Manager):
+    def apply_deltas(self, user_ids, deltas):
+        """
+        Прибавляет к итогам пользователей изменения количества
+        ингредиентов {ingredient_id: delta}.
+        """
+        deltas = {
+            ingredient_id: delta
+            for ingredient_id, delta in deltas.items()
+            if delta
+        }
+        if not deltas:
+            return
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        self.bulk_create(
+            [
+                self.model(user_id=user_id, ingredient_id=ingredient_id)
+                for user_id in user_ids
+                for ingredient_id in deltas
+            ],
+            ignore_conflicts=True,
+        )
+        totals = self.filter(user_id__in=user_ids)
+        totals.filter(ingredient_id__in=deltas).update(
+            amount=F('amount') + Case(
+                *(
+                    When(ingredient_id=ingredient_id, then=Value(delta))
+                    for ingredient_id, delta in deltas.items()
+                ),
+                output_field=models.IntegerField(),
+            )
+        )
+        totals.filter(amount__lte=0).delete()
+
+    def add_recipe(self, user, recipe):
+        self.add_recipes(user, [recipe.pk])
+
+    def remove_recipe(self, user, recipe):
+        self.remove_recipes(user, [recipe.pk])
+
+    def add_recipes(self, user, recipe_ids):
+        if not recipe_ids:
+            return
+        Recipes.objects.lock(recipe_ids)
+        self.apply_deltas([user.id], recipes_amounts(recipe_ids))
+
+    def remove_recipes(self, user, recipe_ids):
+        if not recipe_ids:
+            return
+        Recipes.objects.lock(recipe_ids)
+        self.apply_deltas(
+            [user.id],
+            {
+                ingredient_id: -amount
+                for ingredient_id, amount
+                in recipes_amounts(recipe_ids).items()
+            },
+        )
+
+    def change_recipe(self, recipe, old_amounts, new_amounts):
+        """
+        Пересчитывает итоги всех пользователей с рецептом в корзине.
+        Строка рецепта должна быть заблокирована Recipes.objects.lock()
+        до чтения old_amounts.
+        """
+        deltas = {
+            ingredient_id: (
+                new_amounts.get(ingredient_id, 0)
+                - old_amounts.get(ingredient_id, 0)
+            )
+            for ingredient_id in old_amounts.keys() | new_amounts.keys()
+        }
+        user_ids = ShoppingCartRecipe.objects.filter(
+            recipe=recipe,
+        ).values_list('user_id', flat=True)
+        self.apply_deltas(user_ids, deltas)
+
+    def expected(self, user_ids=None):
+        """
+        Итоги, посчитанные заново по корзинам пользователей: строки
+        (user_id, ingredient_id, amount) одним запросом с GROUP BY.
+        """
+        if user_ids is None:
+            carts = {'recipe__added_to_cart_by__isnull': False}
+        else:
+            carts = {'recipe__added_to_cart_by__user_id__in': user_ids}
+        return (
+            RecipeIngredient.objects
+            .filter(**carts)
+            .values_list('recipe__added_to_cart_by__user_id', 'ingredient_id')
+            .annotate(Sum('amount'))
+            .order_by()
+        )
+
+    def stored(self):
+        return self.values_list(
+            'user_id',
+            'ingredient_id',
+            'amount',
+        ).order_by()
+
+    def stale(self):
+        """Сохранённые итоги, которых нет среди посчитанных заново."""
+        return self.stored().difference(self.expected())
+
+    def missing(self):
+        """Посчитанные заново итоги, которых нет среди сохранённых."""
+        return self.expected().difference(self.stored())
+
+    def rebuild(self, user_ids=None):
+        """
+        Пересчитывает итоги всех пользователей или user_ids одним
+        INSERT ... SELECT в транзакции: строки не загружаются в Python,
+        а до конца пересчёта читаются прежние итоги.
+        """
+        totals = self.all()
+        if user_ids is not None:
+            totals = totals.filter(user_id__in=user_ids)
+        with transaction.atomic(using=self.db):
+            totals.delete()
+            insert_from_select(
+                self.model,
+                ('user', 'ingredient', 'amount'),
+                self.expected(user_ids),
+            )
+
+
+class ShoppingListTotal(models.Model):
+    """Суммарное количество ингредиента в списке покупок пользователя."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_totals',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredients,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_totals',
+        verbose_name='Ингредиент'
+    )
+    amount = models.IntegerField('Количество', default=0)
+
+    objects = ShoppingListTotalManager()
+
+    class Meta:
+        verbose_name = 'итог списка покупок'
+        verbose_name_plural = 'Итоги списков покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_total'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.ingredient.name}"
+
+
+class FeedItemManager(models.Manager):
+    def add_rows(self, rows):
+        """
+        Добавляет строки (user_id, recipe_id, author_id, pub_date)
+        пачками, не собирая все строки в памяти.
+        """
+        rows = iter(rows)
+        while batch := list(islice(rows, FEED_BATCH_SIZE)):
+            self.bulk_create(
+                (
+                    self.model(
+                        user_id=user_id,
+                        recipe_id=recipe_id,
+                        author_id=author_id,
+                        pub_date=pub_date,
+                    )
+                    for user_id, recipe_id, author_id, pub_date in batch
+                ),
+                batch_size=1000,
+                ignore_conflicts=True,
+            )
+
+    def fan_out(self, recipe):
+        """Добавляет рецепт в ленты всех подписчиков его автора."""
+        followers = list(
+            Subscriptions.objects
+            .filter(author_id=recipe.author_id)
+            .values_list('user_id', flat=True)
+        )
+        self.add_rows(
+            (user_id, recipe.id, recipe.author_id, recipe.pub_date)
+            for user_id in followers
+        )
+        return len(followers)
+
+    def follow(self, user, author_ids):
+        """Добавляет в ленту пользователя рецепты новых авторов."""
+        if not author_ids:
+            return
+        self.add_rows(
+            (user.id, recipe_id, author_id, pub_date)
+            for recipe_id, author_id, pub_date
+            in Recipes.objects
+            .filter(author_id__in=author_ids)
+            .values_list('id', 'author_id', 'pub_date')
+            .order_by()
+        )
+
+    def unfollow(self, user, author_ids):
+        if author_ids:
+            self.filter(user=user, author_id__in=author_ids).delete()
+
+    def rebuild(self):
+        self.all().delete()
+        self.add_rows(
+            Recipes.objects
+            .filter(author__following__isnull=False)
+            .values_list('author__following__user_id', 'id', 'author_id',
+                         'pub_date')
+            .order_by()
+            .iterator()
+        )
+
+
+class FeedItem(models.Model):
+    """
+    Рецепт в ленте подписчика. Строки добавляются при публикации
+    рецепта и при подписке, чтобы лента читалась по индексу без
+    соединения со всеми подписками пользователя.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_items',
+        verbose_name='Подписчик'
+    )
+    recipe = models.ForeignKey(
+        Recipes,
+        on_delete=models.CASCADE,
+        related_name='feed_items',
+        verbose_name='Рецепт'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор'
+    )
+    pub_date = models.DateTimeField('Дата публикации')
+
+    objects = FeedItemManager()
+
+    class Meta:
+        verbose_name = 'запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_item'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='feed_user_pub_date_idx',
+            ),
+            models.Index(
+                fields=['user', 'author'],
+                name='feed_user_author_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.recipe_id} в ленте {self.user_id}"
+
+
+class RecipeIndexChange(models.Model):
+    """
+    Журнал изменений ингредиентов рецептов. Id записи служит номером
+    изменения, по которому индексы рецептов в процессах понимают, какие
+    рецепты перечитать.
+    """
+    id = models.BigAutoField(primary_key=True)
+    recipe_ids = models.JSONField('Id рецептов')
+
+    class Meta:
+        verbose_name = 'изменение ингредиентов рецептов'
+        verbose_name_plural = 'Журнал изменений ингредиентов рецептов'
+
+    def __str__(self):
+        return f'Изменение {self.id}'
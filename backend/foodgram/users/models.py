@@ -49,6 +49,11 @@ class User(AbstractUser):
         verbose_name='Подписка',
         default=False,
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Число рецептов',
+        default=0,
+        editable=False,
+    )
 
     REQUIRED_FIELDS = [
         'username',
@@ -66,3 +71,45 @@ class User(AbstractUser):
 
     def __str__(self):
         return f'{self.username} ({self.email})'
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        """
+        recipes_count меняется только через F(), поэтому сохранение
+        пользователя не перезаписывает его устаревшим значением.
+        """
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = loaded_fields(self, {'recipes_count'})
+        super().save(*args, **kwargs)
+        self.loaded_values = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+            if field.attname not in self.get_deferred_fields()
+        }
+
+    def changed_fields(self, fields):
+        """
+        Поля из fields, значения которых отличаются от прочитанных из
+        базы. Поле, значение которого не читалось, считается изменённым.
+        """
+        loaded = getattr(self, 'loaded_values', {})
+        return {
+            name for name in fields
+            if name not in loaded or loaded[name] != getattr(self, name)
+        }
+
+
+def loaded_fields(instance, exclude):
+    """Загруженные поля объекта, кроме первичного ключа и exclude."""
+    deferred = instance.get_deferred_fields()
+    return [
+        field.name for field in instance._meta.concrete_fields
+        if not field.primary_key
+        and field.attname not in deferred
+        and field.name not in exclude
+    ]